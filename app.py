@@ -1,13 +1,14 @@
 import os
 import logging
-from flask import Flask, send_from_directory, jsonify, request, session
+from flask import Flask, send_from_directory, jsonify, request, Response, stream_with_context
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager, login_required, current_user
 from sqlalchemy.orm import DeclarativeBase
 from werkzeug.middleware.proxy_fix import ProxyFix
 
-# Set up logging
-logging.basicConfig(level=logging.DEBUG)
+# Set up logging (levels and format per APP_ENV, see log_config.py)
+import log_config
+log_config.configure()
 
 class Base(DeclarativeBase):
     pass
@@ -18,6 +19,19 @@ db = SQLAlchemy(model_class=Base)
 app = Flask(__name__)
 app.secret_key = os.environ.get("SESSION_SECRET", os.urandom(24))
 app.wsgi_app = ProxyFix(app.wsgi_app, x_proto=1, x_host=1)
+# Let Apache/lighttpd stream files when running behind a server that supports it
+app.config["USE_X_SENDFILE"] = os.environ.get("USE_X_SENDFILE") == "1"
+
+# Server-Sent Events stream settings (seconds)
+SSE_KEEPALIVE = 15
+SSE_RESYNC_INTERVAL = int(os.environ.get("SSE_RESYNC_INTERVAL", "30"))
+SSE_MAX_DURATION = int(os.environ.get("SSE_MAX_DURATION", "300"))
+
+# Maximum page size of /api/worksheets
+LIST_MAX_LIMIT = 200
+
+# If set, /metrics requires "Authorization: Bearer <METRICS_TOKEN>"
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN")
 
 # Configure the database
 app.config["SQLALCHEMY_DATABASE_URI"] = os.environ.get("DATABASE_URL")
@@ -36,36 +50,69 @@ login_manager.init_app(app)
 
 @login_manager.user_loader
 def load_user(user_id):
-    from models import User
-    logging.info(f"Loading user with ID: {user_id}")
+    """The signed-in user, usually from the user cache without a query."""
+    from user_cache import user_cache
     try:
-        user = User.query.get(int(user_id))
-        logging.info(f"Loaded user: {user.email if user else 'None'}")
+        user = user_cache.get(int(user_id))
+        if user is None:
+            logging.info("Session refers to unknown user %s", user_id)
         return user
     except Exception as e:
-        logging.error(f"Error loading user {user_id}: {e}")
+        logging.error("Error loading user %s: %s", user_id, e)
         return None
 
 # Register blueprints
 from google_auth import google_auth
 app.register_blueprint(google_auth)
 
-with app.app_context():
-    # Import models to ensure tables are created
+log_config.init_app(app)
+
+# Request and pipeline metrics, served at /metrics
+import metrics
+metrics.instrument_app(app)
+metrics.registry.start_flusher()
+
+# Keep cached users (see load_user) in step with changes to their rows
+import user_cache
+user_cache.install_invalidation()
+
+@app.cli.command("migrate")
+def migrate():
+    """Create missing tables and apply schema and data migrations.
+
+    Run once per deploy (flask --app main migrate) before starting the
+    app; workers no longer touch the schema when they boot.
+    """
+    import click
     import models
+    import migrations
     db.create_all()
+    migrations.upgrade(db)
+    click.echo("Database schema is up to date")
+
+@app.cli.command("rebuild-embedding-index")
+def rebuild_embedding_index():
+    """Add any stored worksheet embeddings missing from the similarity index."""
+    import click
+    from embedding_index import get_index, sync_from_db
+    added = sync_from_db(get_index())
+    click.echo(f"Indexed {added} new embeddings")
+
+# Start the background worker pool; this also requeues jobs orphaned by a restart
+from job_queue import job_queue
+if os.environ.get("WORKER_AUTOSTART", "1") == "1":
+    job_queue.start()
+    # Retry uploads that were spooled before the last restart
+    from uploader import uploader
+    uploader.start_sweeper()
 
 @app.route("/")
 def index():
-    logging.info(f"Index route accessed. Current user authenticated: {current_user.is_authenticated}")
-    logging.info(f"Current user: {current_user}")
-    logging.info(f"Session data: {session}")
-    
     if not current_user.is_authenticated:
-        logging.info("User not authenticated, showing login page")
+        logging.debug("User not authenticated, showing login page")
         return send_from_directory("static", "login.html")
     
-    logging.info(f"User authenticated: {current_user.email}, showing main app")
+    logging.debug("User authenticated, showing main app")
     return send_from_directory("static", "index.html")
 
 @app.route("/api/worksheet", methods=["POST"])
@@ -83,72 +130,170 @@ def create_worksheet():
     if not data or not required_fields.issubset(data.keys()):
         return jsonify({"error": "Missing required fields"}), 400
     
-    # Generate embedding for the topic
-    from llm_client import generate_embedding
-    try:
-        logging.info(f"Generating embedding for topic: {data['topic']}")
-        embedding = generate_embedding(data["topic"])
-        logging.info(f"Embedding generated successfully with {len(embedding)} dimensions")
-    except Exception as e:
-        logging.error(f"Failed to generate embedding: {e}")
-        return jsonify({"error": "Failed to process request"}), 500
-    
     # Create new worksheet record
     job_id = str(uuid.uuid4())
-    logging.info(f"Creating worksheet record with job_id: {job_id}")
-    
     worksheet = Worksheet(
         id=job_id,
         user_id=current_user.id,
         prompt_json=data,
-        embedding=embedding,
         status="pending"
     )
     
     try:
         db.session.add(worksheet)
         db.session.commit()
-        logging.info(f"Worksheet record saved to database: {job_id}")
     except Exception as e:
-        logging.error(f"Database error saving worksheet: {e}")
+        logging.error("Database error saving worksheet: %s", e)
         db.session.rollback()
         return jsonify({"error": "Database error"}), 500
     
     # Start background job
-    logging.info(f"Starting background job for worksheet: {job_id}")
     try:
         start_generation_job(job_id)
-        logging.info(f"Background job started successfully for: {job_id}")
     except Exception as e:
-        logging.error(f"Failed to start background job: {e}")
+        logging.error("Failed to start background job %s: %s", job_id, e)
         return jsonify({"error": "Failed to start generation"}), 500
     
     return jsonify({"job_id": job_id}), 202
 
+@app.route("/api/worksheets/batch", methods=["POST"])
+@login_required
+def create_worksheet_batch():
+    """Create a batch of worksheet generation jobs, e.g. a whole unit."""
+    from batches import parse_batch_request, create_batch
+    from worker import start_generation_job
+    
+    try:
+        prompts, combine_pdf = parse_batch_request(request.get_json(silent=True))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    try:
+        batch_id, job_ids = create_batch(current_user.id, prompts, combine_pdf)
+    except Exception as e:
+        logging.error("Database error saving worksheet batch: %s", e)
+        return jsonify({"error": "Database error"}), 500
+    
+    # One wakeup; the queue claims the jobs as batch concurrency allows
+    try:
+        start_generation_job(job_ids[0])
+    except Exception as e:
+        logging.error("Failed to start batch %s: %s", batch_id, e)
+        return jsonify({"error": "Failed to start generation"}), 500
+    
+    return jsonify({"batch_id": batch_id, "job_ids": job_ids}), 202
+
+@app.route("/api/worksheets/batch/<batch_id>")
+@login_required
+def get_worksheet_batch(batch_id):
+    """Aggregate status of a worksheet batch."""
+    from models import WorksheetBatch
+    from batches import batch_status
+    
+    batch = WorksheetBatch.query.filter_by(id=batch_id, user_id=current_user.id).first()
+    if not batch:
+        return jsonify({"error": "Batch not found"}), 404
+    
+    return jsonify(batch_status(batch))
+
 @app.route("/api/worksheet/<job_id>/status")
 @login_required
 def get_worksheet_status(job_id):
     """Get the status of a worksheet generation job."""
     from models import Worksheet
     
+    from progress import progress
+    from events import TERMINAL_STATUSES
+    
     worksheet = Worksheet.query.filter_by(id=job_id, user_id=current_user.id).first()
     if not worksheet:
         return jsonify({"error": "Worksheet not found"}), 404
     
-    response = {
-        "status": worksheet.status,
-        "progress_step": worksheet.progress_step,
-        "progress_percent": worksheet.progress_percent,
-        "created_at": worksheet.created_at.isoformat()
-    }
+    # A job running in this process has fresher progress than its row
+    if worksheet.status not in TERMINAL_STATUSES:
+        live = progress.get(job_id)
+        if live:
+            return jsonify(live)
+    return jsonify(worksheet.status_dict())
+
+@app.route("/api/worksheet/<job_id>/trace")
+@login_required
+def get_worksheet_trace(job_id):
+    """Per-stage timing breakdown recorded by a finished job."""
+    from models import Worksheet
     
-    if worksheet.status == "done":
-        response["pdf_path"] = worksheet.pdf_path
-        response["interactive_path"] = worksheet.interactive_path
-    elif worksheet.status == "error":
-        response["error_message"] = worksheet.error_message
+    row = (
+        db.session.query(Worksheet.trace_json)
+        .filter(Worksheet.id == job_id, Worksheet.user_id == current_user.id)
+        .first()
+    )
+    if not row:
+        return jsonify({"error": "Worksheet not found"}), 404
+    if row.trace_json is None:
+        return jsonify({"error": "No trace recorded for this worksheet"}), 404
+    return jsonify(row.trace_json)
+
+@app.route("/api/worksheet/<job_id>/events")
+@login_required
+def worksheet_events(job_id):
+    """Stream status updates of a worksheet generation job as Server-Sent Events."""
+    from models import Worksheet
+    from events import broker, TERMINAL_STATUSES
+    from progress import progress
+    import json
+    import queue
+    import time
+    
+    # Subscribe before reading the current state so no update is missed
+    updates = broker.subscribe(job_id)
+    worksheet = Worksheet.query.filter_by(id=job_id, user_id=current_user.id).first()
+    if not worksheet:
+        broker.unsubscribe(job_id, updates)
+        return jsonify({"error": "Worksheet not found"}), 404
+    status = worksheet.status_dict()
+    if status["status"] not in TERMINAL_STATUSES:
+        status = progress.get(job_id) or status
+    # Don't hold a pooled DB connection for the lifetime of the stream
+    db.session.close()
+    
+    def resync():
+        live = progress.get(job_id)
+        if live:
+            return live
+        ws = Worksheet.query.get(job_id)
+        db.session.close()
+        return ws.status_dict() if ws else None
+    
+    def stream():
+        try:
+            payload = status
+            started = last_sync = time.monotonic()
+            while True:
+                if payload is not None:
+                    yield f"data: {json.dumps(payload)}\n\n"
+                    if payload["status"] in TERMINAL_STATUSES:
+                        return
+                now = time.monotonic()
+                if now - started > SSE_MAX_DURATION:
+                    # The browser's EventSource reconnects on its own
+                    return
+                try:
+                    payload = updates.get(timeout=SSE_KEEPALIVE)
+                except queue.Empty:
+                    yield ": keepalive\n\n"
+                    payload = None
+                    # Safety net for events published by another process
+                    if time.monotonic() - last_sync > SSE_RESYNC_INTERVAL:
+                        last_sync = time.monotonic()
+                        payload = resync()
+        finally:
+            broker.unsubscribe(job_id, updates)
     
-    return jsonify(response)
+    return Response(
+        stream_with_context(stream()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
 @app.route("/api/worksheet/<job_id>/cancel", methods=['POST'])
 @login_required
@@ -162,41 +307,162 @@ def cancel_worksheet(job_id):
     
     # Only allow cancelling if job is pending or in progress
     if worksheet.status in ['pending', 'in_progress']:
-        worksheet.status = 'cancelled'
-        worksheet.progress_step = 'Cancelled by user'
+        from sqlalchemy import case
+        from cancellation import cancel_job, STOPPING_STEP, CANCELLED_STEP
+        # Decided on the row itself, as the job may be claimed meanwhile: a
+        # running job is "stopping" until its run says it has stopped
+        cancelled = (
+            Worksheet.query
+            .filter(Worksheet.id == job_id, Worksheet.status.in_(['pending', 'in_progress']))
+            .update({
+                "status": "cancelled",
+                "progress_step": case((Worksheet.status == "in_progress", STOPPING_STEP), else_=CANCELLED_STEP),
+            }, synchronize_session=False)
+        )
         db.session.commit()
-        logging.info(f"Worksheet {job_id} cancelled by user {current_user.id}")
+        if not cancelled:
+            return jsonify({'success': False, 'message': 'Cannot cancel completed or error jobs'}), 400
+        db.session.refresh(worksheet)
+        # Stop a running job now rather than at its next database read
+        cancel_job(job_id, worksheet.status_dict())
+        if worksheet.batch_id:
+            from batches import job_finished_async
+            job_finished_async(worksheet.batch_id)
+        logging.info("Worksheet %s cancelled by its owner", job_id)
         return jsonify({'success': True, 'message': 'Worksheet generation cancelled'})
     else:
         return jsonify({'success': False, 'message': 'Cannot cancel completed or error jobs'}), 400
 
+@app.route("/api/worksheet/<job_id>/retry", methods=['POST'])
+@login_required
+def retry_worksheet(job_id):
+    """Requeue a failed or cancelled job; it resumes from its last checkpoint."""
+    from sqlalchemy import func, text
+    from models import Worksheet, WorksheetBatch
+    from worker import start_generation_job
+    from cancellation import STOPPING_STEP
+    from job_queue import JOB_LEASE_SECONDS
+    
+    worksheet = Worksheet.query.filter_by(id=job_id, user_id=current_user.id).first()
+    if not worksheet:
+        return jsonify({"error": "Worksheet not found"}), 404
+    
+    if worksheet.status not in ['error', 'cancelled']:
+        return jsonify({'success': False, 'message': 'Only failed or cancelled jobs can be retried'}), 400
+    
+    # The cancelled run, in whichever process, marks the row once it has
+    # stopped; don't start another next to it unless its lease has run out
+    if worksheet.status == 'cancelled' and worksheet.progress_step == STOPPING_STEP:
+        last_seen = func.coalesce(Worksheet.updated_at, Worksheet.created_at)
+        stopping = (
+            db.session.query(Worksheet.id)
+            .filter(Worksheet.id == job_id)
+            .filter(last_seen > func.now() - text(f"interval '{int(JOB_LEASE_SECONDS)} seconds'"))
+            .first()
+        )
+        if stopping:
+            return jsonify({'success': False, 'message': 'The job is still stopping, try again shortly'}), 409
+    
+    worksheet.status = 'pending'
+    worksheet.progress_step = 'Queued for retry'
+    worksheet.progress_percent = 0
+    worksheet.error_message = None
+    if worksheet.batch_id:
+        # The batch (and its combined PDF) completes again once this job
+        # does, unless its combined PDF is being built right now
+        reopened = (
+            WorksheetBatch.query
+            .filter(WorksheetBatch.id == worksheet.batch_id, WorksheetBatch.status != "combining")
+            .update({"status": "in_progress"}, synchronize_session=False)
+        )
+        if not reopened:
+            db.session.rollback()
+            return jsonify({'success': False, 'message': 'The batch is being combined, try again shortly'}), 409
+    db.session.commit()
+    try:
+        start_generation_job(job_id)
+    except Exception as e:
+        logging.error("Failed to start background job %s: %s", job_id, e)
+        return jsonify({"error": "Failed to start generation"}), 500
+    logging.info("Worksheet %s requeued by its owner", job_id)
+    return jsonify({"job_id": job_id}), 202
+
 @app.route("/worksheets/<path:filename>")
 @login_required
 def serve_worksheet(filename):
     """Serve generated worksheet files."""
-    return send_from_directory("worksheets", filename)
+    from artifacts import serve_artifact
+    return serve_artifact("worksheets", filename)
 
 @app.route("/api/worksheets")
 @login_required
 def list_worksheets():
-    """List all worksheets for the current user."""
+    """List the current user's worksheets, newest first.
+    
+    Keyset paginated: pass the X-Next-Cursor response header back as ?cursor=
+    to get the next page. Optional filters: ?status=done and ?topic=<substring>.
+    """
     from models import Worksheet
+    from sqlalchemy import tuple_
+    from datetime import datetime
+    import base64
+    
+    limit = min(max(request.args.get("limit", 50, type=int), 1), LIST_MAX_LIMIT)
+    topic = Worksheet.prompt_json["topic"].as_string()
+    grade_level = Worksheet.prompt_json["gradeLevel"].as_string()
+    
+    # Only the listed columns are read; topic and grade are extracted in SQL
+    query = (
+        db.session.query(
+            Worksheet.id, Worksheet.created_at, Worksheet.status,
+            topic.label("topic"), grade_level.label("grade_level"),
+            Worksheet.pdf_path, Worksheet.interactive_path
+        )
+        .filter(Worksheet.user_id == current_user.id)
+    )
+    
+    if request.args.get("status"):
+        query = query.filter(Worksheet.status == request.args["status"])
+    if request.args.get("topic"):
+        query = query.filter(topic.icontains(request.args["topic"], autoescape=True))
     
-    worksheets = Worksheet.query.filter_by(user_id=current_user.id).order_by(Worksheet.created_at.desc()).all()
+    cursor = request.args.get("cursor")
+    if cursor:
+        try:
+            created_at, last_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|", 1)
+            created_at = datetime.fromisoformat(created_at)
+        except Exception:
+            return jsonify({"error": "Invalid cursor"}), 400
+        query = query.filter(tuple_(Worksheet.created_at, Worksheet.id) < tuple_(created_at, last_id))
+    
+    rows = query.order_by(Worksheet.created_at.desc(), Worksheet.id.desc()).limit(limit + 1).all()
     
     result = []
-    for ws in worksheets:
+    for row in rows[:limit]:
         result.append({
-            "id": ws.id,
-            "created_at": ws.created_at.isoformat(),
-            "status": ws.status,
-            "topic": ws.prompt_json.get("topic", ""),
-            "grade_level": ws.prompt_json.get("gradeLevel", ""),
-            "pdf_path": ws.pdf_path,
-            "interactive_path": ws.interactive_path
+            "id": row.id,
+            "created_at": row.created_at.isoformat(),
+            "status": row.status,
+            "topic": row.topic or "",
+            "grade_level": row.grade_level or "",
+            "pdf_path": row.pdf_path,
+            "interactive_path": row.interactive_path
         })
     
-    return jsonify(result)
+    response = jsonify(result)
+    if len(rows) > limit:
+        last = rows[limit - 1]
+        response.headers["X-Next-Cursor"] = base64.urlsafe_b64encode(
+            f"{last.created_at.isoformat()}|{last.id}".encode()
+        ).decode()
+    return response
+
+@app.route("/metrics")
+def metrics_endpoint():
+    """Prometheus metrics of the app and its worksheet pipeline."""
+    if METRICS_TOKEN and request.headers.get("Authorization") != f"Bearer {METRICS_TOKEN}":
+        return Response("Unauthorized\n", status=401, mimetype="text/plain")
+    return Response(metrics.registry.render(), mimetype="text/plain; version=0.0.4")
 
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=5000, debug=True)
@@ -0,0 +1,119 @@
+import os
+import gzip
+import hashlib
+import logging
+import mimetypes
+import threading
+
+try:
+    import brotli  # optional: enables .br variants
+except ImportError:
+    brotli = None
+
+# Files with these extensions get precompressed variants written next to them
+COMPRESSIBLE_EXTENSIONS = {".html", ".svg", ".json", ".css", ".js", ".txt"}
+ARTIFACT_MAX_AGE = 365 * 24 * 3600
+# If set (e.g. "/protected-worksheets/"), nginx serves the bytes via
+# X-Accel-Redirect and the app only checks auth and caching headers.
+ACCEL_REDIRECT_PREFIX = os.environ.get("ARTIFACT_ACCEL_REDIRECT_PREFIX")
+
+_digests = {}  # path -> (mtime_ns, size, digest)
+_digests_lock = threading.Lock()
+
+
+def file_digest(path):
+    """sha256 hex digest of a file, memoized by mtime and size."""
+    stat = os.stat(path)
+    with _digests_lock:
+        cached = _digests.get(path)
+    if cached and cached[:2] == (stat.st_mtime_ns, stat.st_size):
+        return cached[2]
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 16), b""):
+            sha.update(chunk)
+    digest = sha.hexdigest()
+    with _digests_lock:
+        _digests[path] = (stat.st_mtime_ns, stat.st_size, digest)
+    return digest
+
+
+def finalize_artifact(path):
+    """Write precompressed variants of a finished artifact; return its digest.
+
+    Call once after an artifact is written. Variants are written atomically so
+    a concurrent request never sees a partial file.
+    """
+    digest = file_digest(path)
+    if os.path.splitext(path)[1].lower() not in COMPRESSIBLE_EXTENSIONS:
+        return digest
+    with open(path, "rb") as f:
+        data = f.read()
+    variants = {".gz": lambda: gzip.compress(data, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        variants[".br"] = lambda: brotli.compress(data, quality=11)
+    for suffix, compress in variants.items():
+        tmp_path = f"{path}{suffix}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                f.write(compress())
+            os.replace(tmp_path, path + suffix)
+        except Exception as e:
+            logging.error("Failed to precompress %s%s: %s", path, suffix, e)
+    return digest
+
+
+def versioned_path(path, digest):
+    """Local URL path that changes whenever the content does."""
+    return f"{path}?v={digest[:16]}"
+
+
+def _choose_variant(path, accept_encoding):
+    accepted = {part.split(";")[0].strip() for part in accept_encoding.split(",")}
+    for encoding, suffix in (("br", ".br"), ("gzip", ".gz")):
+        variant = path + suffix
+        if encoding in accepted and os.path.exists(variant):
+            if os.path.getmtime(variant) >= os.path.getmtime(path):
+                return variant, encoding
+    return path, None
+
+
+def serve_artifact(directory, filename):
+    """Serve a generated file with strong ETags, long-lived caching for
+    versioned URLs, precompressed variants and conditional/range requests."""
+    from flask import request, send_file, abort, make_response
+    from werkzeug.security import safe_join
+
+    # Hidden files and directories (e.g. the image store) are internal state
+    if any(part.startswith(".") for part in filename.replace("\\", "/").split("/")):
+        abort(404)
+    path = safe_join(os.path.abspath(directory), filename)
+    if path is None or not os.path.isfile(path):
+        abort(404)
+
+    digest = file_digest(path)
+    variant, encoding = _choose_variant(path, request.headers.get("Accept-Encoding", ""))
+    etag = digest if encoding is None else f"{digest}-{encoding}"
+    mimetype = mimetypes.guess_type(path)[0] or "application/octet-stream"
+
+    if ACCEL_REDIRECT_PREFIX:
+        if request.if_none_match.contains(etag):
+            response = make_response("", 304)
+        else:
+            response = make_response("")
+            relative = os.path.relpath(variant, os.path.abspath(directory)).replace(os.sep, "/")
+            response.headers["X-Accel-Redirect"] = ACCEL_REDIRECT_PREFIX.rstrip("/") + "/" + relative
+            response.mimetype = mimetype
+        response.set_etag(etag)
+    else:
+        response = send_file(variant, mimetype=mimetype, etag=etag, conditional=True)
+
+    if encoding:
+        response.headers["Content-Encoding"] = encoding
+    response.headers["Vary"] = "Accept-Encoding"
+    if request.args.get("v") == digest[:16]:
+        # The URL names this exact content, so it can never change
+        response.headers["Cache-Control"] = f"private, max-age={ARTIFACT_MAX_AGE}, immutable"
+    else:
+        response.headers["Cache-Control"] = "private, no-cache"
+    return response
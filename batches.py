@@ -0,0 +1,209 @@
+import os
+import uuid
+import logging
+import threading
+from datetime import datetime, timedelta, timezone
+
+# Largest number of worksheets accepted in one batch request
+BATCH_MAX_SIZE = int(os.environ.get("BATCH_MAX_SIZE", "50"))
+# Jobs of one batch that may run at once, so a large batch doesn't take
+# every worker slot from other users' jobs
+BATCH_MAX_CONCURRENCY = int(os.environ.get("BATCH_MAX_CONCURRENCY", "2"))
+
+REQUIRED_FIELDS = {"gradeLevel", "topic", "activities", "style", "imagesAllowed"}
+ACTIVE_STATUSES = ("pending", "in_progress")
+
+
+def parse_batch_request(data):
+    """Validate a batch request body; returns (prompts, combine_pdf).
+
+    The body is {"prompts": [...], "defaults": {...}, "combinedPdf": bool}.
+    Fields in defaults (e.g. gradeLevel and style shared by a unit) apply to
+    every prompt that doesn't set them. Raises ValueError with a message.
+    """
+    if not isinstance(data, dict) or not isinstance(data.get("prompts"), list):
+        raise ValueError("Expected a list of prompts")
+    defaults = data.get("defaults") or {}
+    if not isinstance(defaults, dict):
+        raise ValueError("defaults must be an object")
+    if not data["prompts"]:
+        raise ValueError("No prompts given")
+    if len(data["prompts"]) > BATCH_MAX_SIZE:
+        raise ValueError(f"At most {BATCH_MAX_SIZE} prompts per batch")
+    prompts = []
+    for n, prompt in enumerate(data["prompts"]):
+        if not isinstance(prompt, dict):
+            raise ValueError(f"Prompt {n} is not an object")
+        prompt = {**defaults, **prompt}
+        if not REQUIRED_FIELDS.issubset(prompt.keys()):
+            raise ValueError(f"Prompt {n} is missing required fields")
+        prompts.append(prompt)
+    return prompts, bool(data.get("combinedPdf"))
+
+
+def create_batch(user_id, prompts, combine_pdf=False):
+    """Create a batch and all of its worksheet rows; returns (batch_id, job_ids).
+
+    Topic embeddings are fetched in a single API call and stored with the
+    rows, which are inserted in one statement. The caller starts the jobs.
+    """
+    from sqlalchemy import insert
+    from app import db
+    from models import Worksheet, WorksheetBatch
+    from llm_client import generate_embeddings
+    from embedding_index import index_worksheets
+
+    try:
+        embeddings = generate_embeddings([prompt["topic"] for prompt in prompts])
+    except Exception as e:
+        # Not fatal: each job computes its own embedding if it is missing
+        logging.error("Failed to generate batch embeddings: %s", e)
+        embeddings = [None] * len(prompts)
+
+    batch_id = str(uuid.uuid4())
+    # Distinct timestamps keep the request order for scheduling and listing
+    now = datetime.now(timezone.utc)
+    rows = [
+        {
+            "id": str(uuid.uuid4()),
+            "user_id": user_id,
+            "created_at": now + timedelta(microseconds=n),
+            "prompt_json": prompt,
+            "embedding": embedding,
+            "status": "pending",
+            "progress_percent": 0,
+            "batch_id": batch_id,
+        }
+        for n, (prompt, embedding) in enumerate(zip(prompts, embeddings))
+    ]
+    try:
+        db.session.add(WorksheetBatch(id=batch_id, user_id=user_id, combine_pdf=combine_pdf,
+                                      status="in_progress"))
+        db.session.flush()
+        db.session.execute(insert(Worksheet), rows)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    index_worksheets([(row["id"], row["embedding"]) for row in rows])
+    logging.info("Created batch %s with %s worksheets", batch_id, len(rows))
+    return batch_id, [row["id"] for row in rows]
+
+
+def batch_status(batch):
+    """Aggregate progress of a batch from its worksheets' current state."""
+    from app import db
+    from models import Worksheet
+
+    rows = (
+        db.session.query(Worksheet.id, Worksheet.status, Worksheet.progress_percent,
+                         Worksheet.prompt_json["topic"].as_string().label("topic"))
+        .filter(Worksheet.batch_id == batch.id)
+        .order_by(Worksheet.created_at, Worksheet.id)
+        .all()
+    )
+
+    counts = {}
+    total_percent = 0
+    for row in rows:
+        counts[row.status] = counts.get(row.status, 0) + 1
+        total_percent += 100 if row.status not in ACTIVE_STATUSES else (row.progress_percent or 0)
+
+    response = {
+        "batch_id": batch.id,
+        "status": batch.status,
+        "total": len(rows),
+        "counts": counts,
+        "progress_percent": round(total_percent / len(rows)) if rows else 100,
+        "created_at": batch.created_at.isoformat(),
+        "worksheets": [
+            {"id": row.id, "topic": row.topic, "status": row.status,
+             "progress_percent": row.progress_percent}
+            for row in rows
+        ],
+    }
+    if batch.combine_pdf:
+        response["combined_pdf_path"] = batch.combined_pdf_path
+    if batch.status == "error":
+        response["error_message"] = batch.error_message
+    return response
+
+
+def _claim_completion(batch_id):
+    """Atomically move a batch whose worksheets have all finished out of
+    in_progress. Returns whether a combined PDF is wanted, or None if the
+    batch is not complete or another process got there first."""
+    from sqlalchemy import text
+    from app import db
+
+    row = db.session.execute(
+        text(
+            "UPDATE worksheet_batches SET status = "
+            "CASE WHEN combine_pdf THEN 'combining' ELSE 'done' END "
+            "WHERE id = :id AND status = 'in_progress' AND NOT EXISTS ("
+            "SELECT 1 FROM worksheets WHERE batch_id = :id "
+            "AND status IN ('pending', 'in_progress')) "
+            "RETURNING combine_pdf"
+        ),
+        {"id": batch_id},
+    ).first()
+    db.session.commit()
+    return None if row is None else row.combine_pdf
+
+
+def job_finished(batch_id):
+    """Called when a worksheet of a batch reaches a final state; the call for
+    the last one completes the batch and builds its combined PDF."""
+    from app import app
+
+    with app.app_context():
+        try:
+            combine = _claim_completion(batch_id)
+        except Exception as e:
+            logging.error("Failed to check completion of batch %s: %s", batch_id, e)
+            return
+        if combine:
+            build_combined_pdf(batch_id)
+        elif combine is not None:
+            logging.info("Batch %s complete", batch_id)
+
+
+def job_finished_async(batch_id):
+    """job_finished on a background thread, for request handlers."""
+    threading.Thread(target=job_finished, args=(batch_id,), daemon=True).start()
+
+
+def build_combined_pdf(batch_id):
+    """Render the finished worksheets of a batch into one PDF and store it."""
+    from sqlalchemy import update
+    from sqlalchemy.orm import undefer
+    from app import db
+    from models import Worksheet, WorksheetBatch
+    from pdf_generator import create_combined_pdf
+    from artifacts import finalize_artifact, versioned_path
+    from uploader import uploader
+
+    try:
+        worksheets = (
+            Worksheet.query
+            .options(undefer(Worksheet.spec_json), undefer(Worksheet.checkpoint_json))
+            .filter(Worksheet.batch_id == batch_id, Worksheet.status == "done")
+            .order_by(Worksheet.created_at, Worksheet.id)
+            .all()
+        )
+        # Image paths come from each job's checkpoint
+        items = [(ws.spec_json, (ws.checkpoint_json or {}).get("images", {}))
+                 for ws in worksheets if ws.spec_json]
+        local_path = create_combined_pdf(items, f"worksheets/batches/{batch_id}/combined.pdf")
+        digest = finalize_artifact(local_path)
+        url = uploader.upload(local_path, f"batches/{batch_id}/combined.pdf")
+        if url == local_path:
+            url = versioned_path(local_path, digest)
+        values = {"status": "done", "combined_pdf_path": url, "error_message": None}
+        logging.info("Combined PDF of batch %s ready: %s", batch_id, url)
+    except Exception as e:
+        db.session.rollback()
+        logging.error("Failed to build combined PDF of batch %s: %s", batch_id, e)
+        values = {"status": "error", "error_message": str(e)}
+    db.session.execute(update(WorksheetBatch).where(WorksheetBatch.id == batch_id).values(values))
+    db.session.commit()
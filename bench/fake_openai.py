@@ -0,0 +1,185 @@
+"""Local stand-in for the OpenAI API, for benchmarks and offline development.
+
+Run:  python -m bench.fake_openai --port 8787 --latency 0.5 --chunk-delay 0.01
+Then: OPENAI_BASE_URL=http://127.0.0.1:8787/v1 OPENAI_API_KEY=bench ...
+
+Implements what the app calls: POST /v1/responses (streamed worksheet specs
+and the non-streamed image request) and POST /v1/embeddings. Specs are canned
+(--specs, a JSON list of spec objects; a built-in one by default) and streamed
+in small deltas like the real API. Embeddings are deterministic per input text,
+so identical topics hit the caches and different ones don't. Latency and a
+failure rate can be injected.
+"""
+import json
+import time
+import random
+import hashlib
+import argparse
+import itertools
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import numpy as np
+
+EMBEDDING_DIMENSIONS = 1536
+
+DEFAULT_SPEC = {
+    "title": "Exploring the Water Cycle",
+    "instructions": "Read each question carefully and write your answer in the space provided.",
+    "elements": [
+        {"type": "text", "content": "1. What happens to water when the sun heats it?",
+         "position": {"x": 50, "y": 120}, "style": {"fontSize": 12, "bold": False}},
+        {"type": "input_field", "placeholder": "Answer space",
+         "position": {"x": 50, "y": 150}, "size": {"width": 400, "height": 30}},
+        {"type": "image", "description": "clouds forming over a lake",
+         "position": {"x": 50, "y": 200}, "size": {"width": 200, "height": 150}},
+        {"type": "text", "content": "2. Name the process where water falls from clouds.",
+         "position": {"x": 50, "y": 380}, "style": {"fontSize": 12, "bold": False}},
+        {"type": "input_field", "placeholder": "Answer space",
+         "position": {"x": 50, "y": 410}, "size": {"width": 400, "height": 30}},
+        {"type": "image", "description": "rain falling on mountains",
+         "position": {"x": 300, "y": 200}, "size": {"width": 200, "height": 150}},
+        {"type": "text", "content": "3. Draw arrows to show how water moves through the cycle.",
+         "position": {"x": 50, "y": 470}, "style": {"fontSize": 12, "bold": True}},
+        {"type": "input_field", "placeholder": "Explain your drawing",
+         "position": {"x": 50, "y": 500}, "size": {"width": 400, "height": 60}},
+    ],
+}
+
+
+def embedding_for(text):
+    """Deterministic unit vector for a text."""
+    seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+    v = np.random.default_rng(seed).standard_normal(EMBEDDING_DIMENSIONS).astype(np.float32)
+    return (v / np.linalg.norm(v)).tolist()
+
+
+def _chunks(text, size):
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+
+def make_handler(specs, latency=0.0, chunk_delay=0.0, chunk_size=16,
+                 embedding_latency=0.0, image_latency=0.0, fail_rate=0.0):
+    spec_cycle = itertools.cycle(specs)
+
+    class OpenAIHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def _reply(self, status, payload):
+            body = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _read_json(self):
+            length = int(self.headers.get("Content-Length", 0))
+            return json.loads(self.rfile.read(length) or b"{}")
+
+        def do_POST(self):
+            request = self._read_json()
+            if not self.headers.get("Authorization"):
+                return self._reply(401, {"error": {"message": "missing authorization"}})
+            if random.random() < fail_rate:
+                return self._reply(503, {"error": {"message": "injected failure"}})
+            if self.path.endswith("/embeddings"):
+                return self._embeddings(request)
+            if self.path.endswith("/responses"):
+                if request.get("stream"):
+                    return self._stream_spec()
+                return self._image(request)
+            self._reply(404, {"error": {"message": f"unknown path {self.path}"}})
+
+        def _embeddings(self, request):
+            if embedding_latency:
+                time.sleep(embedding_latency)
+            texts = request.get("input")
+            if isinstance(texts, str):
+                texts = [texts]
+            self._reply(200, {
+                "object": "list",
+                "model": request.get("model"),
+                "data": [{"object": "embedding", "index": n, "embedding": embedding_for(text)}
+                         for n, text in enumerate(texts)],
+                "usage": {"prompt_tokens": 0, "total_tokens": 0},
+            })
+
+        def _image(self, request):
+            # The app doesn't use the image response yet (it draws a
+            # placeholder), only its latency matters
+            if image_latency:
+                time.sleep(image_latency)
+            self._reply(200, {"id": "resp_fake", "object": "response", "status": "completed",
+                              "model": request.get("model"), "output": []})
+
+        def _stream_spec(self):
+            text = json.dumps(next(spec_cycle), indent=2)
+            if latency:
+                time.sleep(latency)  # time to first token
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Cache-Control", "no-cache")
+            self.send_header("Connection", "close")
+            self.end_headers()
+            self.close_connection = True
+            events = [{"type": "response.created", "response": {"id": "resp_fake", "status": "in_progress"}}]
+            events += [{"type": "response.output_text.delta", "item_id": "msg_fake", "output_index": 0,
+                        "content_index": 0, "delta": chunk} for chunk in _chunks(text, chunk_size)]
+            events.append({"type": "response.completed", "response": {"id": "resp_fake", "status": "completed"}})
+            try:
+                for n, event in enumerate(events):
+                    event["sequence_number"] = n
+                    self.wfile.write(f"event: {event['type']}\ndata: {json.dumps(event)}\n\n".encode("utf-8"))
+                    self.wfile.flush()
+                    if chunk_delay and event["type"] == "response.output_text.delta":
+                        time.sleep(chunk_delay)
+            except (BrokenPipeError, ConnectionResetError):
+                pass  # client closed the stream, e.g. a cancelled job
+
+    return OpenAIHandler
+
+
+def load_specs(path):
+    if not path:
+        return [DEFAULT_SPEC]
+    with open(path) as f:
+        specs = json.load(f)
+    return specs if isinstance(specs, list) else [specs]
+
+
+def serve(specs=None, host="127.0.0.1", port=8787, background=False, **options):
+    """Start the fake API; with background=True returns the running server."""
+    server = ThreadingHTTPServer((host, port), make_handler(specs or [DEFAULT_SPEC], **options))
+    server.daemon_threads = True
+    if background:
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+    print(f"Fake OpenAI API on http://{host}:{server.server_port}/v1")
+    server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8787)
+    parser.add_argument("--specs", help="JSON file with a spec or a list of specs to serve in turn")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds before the first spec token")
+    parser.add_argument("--chunk-delay", type=float, default=0.0, help="seconds between spec deltas")
+    parser.add_argument("--chunk-size", type=int, default=16, help="characters per spec delta")
+    parser.add_argument("--embedding-latency", type=float, default=0.0)
+    parser.add_argument("--image-latency", type=float, default=0.0)
+    parser.add_argument("--fail-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    serve(load_specs(args.specs), args.host, args.port, latency=args.latency,
+          chunk_delay=args.chunk_delay, chunk_size=args.chunk_size,
+          embedding_latency=args.embedding_latency, image_latency=args.image_latency,
+          fail_rate=args.fail_rate)
+
+
+if __name__ == "__main__":
+    main()
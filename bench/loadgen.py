@@ -0,0 +1,160 @@
+"""End-to-end load generator: N concurrent users creating worksheets and
+polling their status, as the web client does.
+
+Start the stand-ins and the app against them, then run the generator with the
+same DATABASE_URL and SESSION_SECRET as the app (it creates bench users and
+signs their session cookies itself, so no OAuth round trip is needed):
+
+    python -m bench.fake_openai --latency 0.5 --chunk-delay 0.005 &
+    python storage_standin.py --root /tmp/bench-storage &
+    export OPENAI_BASE_URL=http://127.0.0.1:8787/v1 OPENAI_API_KEY=bench \\
+           STORAGE_URL=http://127.0.0.1:54321 SUPABASE_SERVICE_KEY=bench SESSION_SECRET=bench
+    gunicorn -w 2 -b 127.0.0.1:5000 main:app &
+    python -m bench.loadgen --users 10 --jobs-per-user 5
+
+Reports p50/p95/p99 of worksheet creation, status polls and whole jobs
+(creation until done), plus jobs/min; results go to bench/results/.
+"""
+import os
+import time
+import random
+import argparse
+import threading
+
+import requests
+
+from bench.results import summarize, print_table, write_result
+
+TERMINAL_STATUSES = {"done", "error", "cancelled"}
+
+TOPICS = ["the water cycle", "fractions", "photosynthesis", "the solar system", "volcanoes",
+          "multiplication tables", "the American Revolution", "simple machines", "food chains",
+          "states of matter", "telling time", "the human skeleton"]
+
+
+def session_cookies(users):
+    """Create (or reuse) bench users; returns a signed session cookie each."""
+    # Only the app's database and signing key are needed; don't start a
+    # worker pool competing with the app under test for jobs
+    os.environ.setdefault("WORKER_AUTOSTART", "0")
+    from app import app, db
+    from models import User
+
+    serializer = app.session_interface.get_signing_serializer(app)
+    cookies = []
+    with app.app_context():
+        for n in range(users):
+            email = f"bench-{n}@bench.invalid"
+            user = User.query.filter_by(email=email).first()
+            if user is None:
+                user = User(username=f"bench-{n}", email=email)
+                db.session.add(user)
+                db.session.commit()
+            # What Flask-Login stores in the session on login
+            cookies.append(serializer.dumps({"_user_id": str(user.id), "_fresh": True}))
+    return app.config["SESSION_COOKIE_NAME"], cookies
+
+
+def prompt(topic_pool):
+    """A worksheet request; with a topic pool topics repeat, exercising the caches."""
+    if topic_pool:
+        topic = TOPICS[random.randrange(min(topic_pool, len(TOPICS)))]
+    else:
+        topic = f"{random.choice(TOPICS)} (variant {random.getrandbits(32):08x})"
+    return {"gradeLevel": random.choice(["2", "4", "6", "8"]), "topic": topic,
+            "activities": "questions, diagram labeling", "style": "playful",
+            "imagesAllowed": True}
+
+
+class Recorder:
+    def __init__(self):
+        self.samples = {"create": [], "status": [], "job": []}
+        self.outcomes = {}
+        self._lock = threading.Lock()
+
+    def sample(self, name, seconds):
+        with self._lock:
+            self.samples[name].append(seconds)
+
+    def outcome(self, status):
+        with self._lock:
+            self.outcomes[status] = self.outcomes.get(status, 0) + 1
+
+
+def run_user(base_url, cookie_name, cookie, args, recorder):
+    http = requests.Session()
+    http.cookies.set(cookie_name, cookie)
+    for _ in range(args.jobs_per_user):
+        started = time.perf_counter()
+        try:
+            response = http.post(f"{base_url}/api/worksheet", json=prompt(args.topic_pool), timeout=30)
+        except requests.RequestException:
+            recorder.outcome("request_failed")
+            continue
+        recorder.sample("create", time.perf_counter() - started)
+        if response.status_code != 202:
+            recorder.outcome(f"http_{response.status_code}")
+            continue
+        job_id = response.json()["job_id"]
+
+        status = None
+        deadline = started + args.job_timeout
+        while time.perf_counter() < deadline:
+            time.sleep(args.poll_interval)
+            poll_started = time.perf_counter()
+            try:
+                response = http.get(f"{base_url}/api/worksheet/{job_id}/status", timeout=30)
+            except requests.RequestException:
+                continue
+            recorder.sample("status", time.perf_counter() - poll_started)
+            if response.ok:
+                status = response.json().get("status")
+                if status in TERMINAL_STATUSES:
+                    break
+        else:
+            status = "timeout"
+        recorder.outcome(status)
+        if status == "done":
+            recorder.sample("job", time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", default="http://127.0.0.1:5000")
+    parser.add_argument("--users", type=int, default=10, help="concurrent users")
+    parser.add_argument("--jobs-per-user", type=int, default=5)
+    parser.add_argument("--poll-interval", type=float, default=1.0, help="seconds between status polls")
+    parser.add_argument("--job-timeout", type=float, default=300.0)
+    parser.add_argument("--topic-pool", type=int, default=0,
+                        help="draw topics from this many fixed ones (0: every topic unique)")
+    parser.add_argument("--output", help="result file (default: bench/results/load-<commit>-<time>.json)")
+    args = parser.parse_args()
+
+    cookie_name, cookies = session_cookies(args.users)
+    base_url = args.url.rstrip("/")
+    recorder = Recorder()
+    threads = [threading.Thread(target=run_user, args=(base_url, cookie_name, cookie, args, recorder))
+               for cookie in cookies]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    results = {name: summarize(samples) for name, samples in recorder.samples.items()}
+    done = recorder.outcomes.get("done", 0)
+    print_table(results)
+    print(f"{done} jobs done in {elapsed:.1f}s: {done / elapsed * 60:.1f} jobs/min; outcomes {recorder.outcomes}")
+    path = write_result("load", {
+        "parameters": {k: v for k, v in vars(args).items() if k != "output"},
+        "elapsed": elapsed,
+        "jobs_per_minute": done / elapsed * 60,
+        "outcomes": recorder.outcomes,
+        "benchmarks": results,
+    }, args.output)
+    print(f"Results written to {path}")
+
+
+if __name__ == "__main__":
+    main()
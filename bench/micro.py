@@ -0,0 +1,109 @@
+"""Microbenchmarks of the CPU-bound pipeline stages.
+
+Run:  python -m bench.micro [--samples 200] [--filter pdf]
+
+Measures spec stream parsing, layout, and PDF and interactive HTML rendering
+for a typical spec and a long multi-page one. Outputs are written to a
+temporary directory; results go to bench/results/ (see bench.results).
+"""
+import os
+import gc
+import json
+import time
+import argparse
+import tempfile
+
+from bench.fake_openai import DEFAULT_SPEC
+from bench.results import summarize, print_table, write_result
+
+DELTA_SIZE = 16  # characters per streamed delta, like the API's small chunks
+
+
+def long_spec(questions=40):
+    """A spec long enough to span several pages."""
+    elements = []
+    for n in range(1, questions + 1):
+        elements.append({"type": "text", "content": f"{n}. " + "Explain how the water cycle affects "
+                         "the weather where you live, using the words evaporation and condensation. " * 2,
+                         "position": {"x": 50, "y": 100}, "style": {"fontSize": 12, "bold": n % 5 == 0}})
+        elements.append({"type": "input_field", "placeholder": "Answer space",
+                         "position": {"x": 50, "y": 100}, "size": {"width": 400, "height": 40}})
+        if n % 8 == 0:
+            elements.append({"type": "image", "description": f"diagram {n}",
+                             "position": {"x": 50, "y": 100}, "size": {"width": 200, "height": 150}})
+    return dict(DEFAULT_SPEC, title="Unit Review: The Water Cycle and Weather", elements=elements)
+
+
+def _images(spec):
+    return {e["description"]: f"images/{n}.png"
+            for n, e in enumerate(spec["elements"]) if e["type"] == "image"}
+
+
+def _benchmarks(spec_name, spec):
+    from llm_client import SpecStreamParser
+    from layout import layout_spec
+    from pdf_generator import create_pdf_from_spec
+    from interactive_generator import generate_interactive_html
+
+    text = json.dumps(spec, indent=2)
+    deltas = [text[i:i + DELTA_SIZE] for i in range(0, len(text), DELTA_SIZE)]
+    images = _images(spec)
+    layout = layout_spec(spec, images)
+
+    def parse_stream():
+        parser = SpecStreamParser()
+        for delta in deltas:
+            parser.feed(delta)
+        parser.finish()
+
+    return {
+        f"spec_parse_stream[{spec_name}]": parse_stream,
+        f"layout_spec[{spec_name}]": lambda: layout_spec(spec, images),
+        f"create_pdf_from_spec[{spec_name}]": lambda: create_pdf_from_spec(spec, "bench", images, layout),
+        f"generate_interactive_html[{spec_name}]": lambda: generate_interactive_html(spec, "bench", images, layout),
+    }
+
+
+def measure(fn, samples, warmup=5):
+    """Time samples calls of fn; returns the per-call durations."""
+    for _ in range(warmup):
+        fn()
+    durations = []
+    gc.collect()
+    for _ in range(samples):
+        start = time.perf_counter()
+        fn()
+        durations.append(time.perf_counter() - start)
+    return durations
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--samples", type=int, default=200)
+    parser.add_argument("--filter", help="only run benchmarks whose name contains this")
+    parser.add_argument("--output", help="result file (default: bench/results/micro-<commit>-<time>.json)")
+    args = parser.parse_args()
+
+    benchmarks = {}
+    for spec_name, spec in (("default", DEFAULT_SPEC), ("long", long_spec())):
+        benchmarks.update(_benchmarks(spec_name, spec))
+
+    results = {}
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as scratch:
+        os.chdir(scratch)  # the generators write under worksheets/<job_id>
+        try:
+            for name, fn in benchmarks.items():
+                if args.filter and args.filter not in name:
+                    continue
+                results[name] = summarize(measure(fn, args.samples))
+        finally:
+            os.chdir(cwd)
+
+    print_table(results)
+    path = write_result("micro", {"samples": args.samples, "benchmarks": results}, args.output)
+    print(f"Results written to {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""Summaries and result files shared by the benchmarks.
+
+Every run is written as JSON tagged with the commit it measured, so runs of
+different commits can be compared with:
+
+    python -m bench.results bench/results/<old>.json bench/results/<new>.json
+"""
+import os
+import sys
+import json
+import platform
+import argparse
+import subprocess
+from datetime import datetime, timezone
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+
+
+def percentile(sorted_values, p):
+    """p-th percentile (0-100) of sorted values, linearly interpolated."""
+    if not sorted_values:
+        return None
+    k = (len(sorted_values) - 1) * p / 100
+    low = int(k)
+    high = min(low + 1, len(sorted_values) - 1)
+    return sorted_values[low] + (sorted_values[high] - sorted_values[low]) * (k - low)
+
+
+def summarize(samples):
+    """Latency summary (seconds) of a list of samples."""
+    values = sorted(samples)
+    if not values:
+        return {"count": 0}
+    return {
+        "count": len(values),
+        "mean": sum(values) / len(values),
+        "min": values[0],
+        "p50": percentile(values, 50),
+        "p95": percentile(values, 95),
+        "p99": percentile(values, 99),
+        "max": values[-1],
+    }
+
+
+def _git(*args):
+    try:
+        return subprocess.run(["git", *args], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def environment():
+    """What a result was measured on: commit, host and interpreter."""
+    return {
+        "commit": _git("rev-parse", "--short", "HEAD"),
+        "dirty": bool(_git("status", "--porcelain", "--untracked-files=no")),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+    }
+
+
+def write_result(kind, result, path=None):
+    """Write a result with its environment; returns the file path."""
+    env = environment()
+    if path is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        stamp = env["timestamp"][:19].replace(":", "").replace("-", "")
+        path = os.path.join(RESULTS_DIR, f"{kind}-{env['commit'] or 'unknown'}-{stamp}.json")
+    with open(path, "w") as f:
+        json.dump({"kind": kind, "environment": env, **result}, f, indent=2)
+    return path
+
+
+def format_seconds(value):
+    if value is None:
+        return "-"
+    if value < 1e-3:
+        return f"{value * 1e6:.1f}us"
+    if value < 1:
+        return f"{value * 1e3:.2f}ms"
+    return f"{value:.2f}s"
+
+
+def print_table(rows, stats=("p50", "p95", "p99", "mean"), out=sys.stdout):
+    """rows: {name: summary}."""
+    width = max([len(name) for name in rows] + [4])
+    out.write(f"{'name':<{width}}  {'count':>6}  " + "  ".join(f"{s:>9}" for s in stats) + "\n")
+    for name, summary in rows.items():
+        cells = "  ".join(f"{format_seconds(summary.get(s)):>9}" for s in stats)
+        out.write(f"{name:<{width}}  {summary.get('count', 0):>6}  {cells}\n")
+
+
+def compare(old, new, stat="p50", out=sys.stdout):
+    """Print the change of each benchmark between two result files."""
+    old_rows, new_rows = old["benchmarks"], new["benchmarks"]
+    out.write(f"{old['environment']['commit']} -> {new['environment']['commit']} ({stat})\n")
+    width = max([len(name) for name in new_rows] + [4])
+    for name, summary in new_rows.items():
+        before = old_rows.get(name, {}).get(stat)
+        after = summary.get(stat)
+        change = f"{(after - before) / before:+.1%}" if before and after is not None else "new"
+        out.write(f"{name:<{width}}  {format_seconds(before):>9}  {format_seconds(after):>9}  {change:>8}\n")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare two benchmark result files")
+    parser.add_argument("old")
+    parser.add_argument("new")
+    parser.add_argument("--stat", default="p50")
+    args = parser.parse_args()
+    with open(args.old) as f_old, open(args.new) as f_new:
+        compare(json.load(f_old), json.load(f_new), args.stat)
@@ -0,0 +1,99 @@
+"""Import-time benchmark: how long a fresh process takes to load the app.
+
+Run:  python -m bench.startup [--runs 10] [--module app --module worker]
+
+Each run imports the module in a new interpreter with -X importtime, as a
+gunicorn worker or a scaled-up instance does on boot. The worker pool is not
+started and DATABASE_URL defaults to in-memory SQLite, so no services are
+needed. Reports wall time (minus a bare interpreter start) and the cumulative
+import time of the module, plus its slowest direct imports; results go to
+bench/results/ (see bench.results).
+"""
+import os
+import sys
+import time
+import argparse
+import subprocess
+
+from bench.results import summarize, print_table, write_result
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _environment():
+    env = dict(os.environ)
+    env["WORKER_AUTOSTART"] = "0"
+    env.setdefault("DATABASE_URL", "sqlite://")
+    env.setdefault("OPENAI_API_KEY", "bench")
+    return env
+
+
+def _run(code, env, importtime=False):
+    """Run code in a fresh interpreter; returns (wall seconds, stderr)."""
+    command = [sys.executable] + (["-X", "importtime"] if importtime else []) + ["-c", code]
+    started = time.perf_counter()
+    result = subprocess.run(command, cwd=ROOT, env=env, capture_output=True, text=True)
+    elapsed = time.perf_counter() - started
+    if result.returncode != 0:
+        raise RuntimeError(f"{code!r} failed:\n{result.stderr[-2000:]}")
+    return elapsed, result.stderr
+
+
+def parse_importtime(stderr):
+    """[(module, self us, cumulative us, depth)] from -X importtime output."""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        head, cumulative_us, name = line.split("|")
+        # One space after the bar, then two per nesting level
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        rows.append((name.strip(), int(head.split(":")[1]), int(cumulative_us), depth))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--module", action="append", help="module to import (default: app, worker)")
+    parser.add_argument("--top", type=int, default=10, help="slowest direct imports to list")
+    parser.add_argument("--output", help="result file (default: bench/results/startup-<commit>-<time>.json)")
+    args = parser.parse_args()
+    modules = args.module or ["app", "worker"]
+    env = _environment()
+
+    interpreter = [_run("pass", env)[0] for _ in range(args.runs)]
+    baseline = summarize(interpreter)["p50"]
+    results = {"interpreter": summarize(interpreter)}
+    slowest = {}
+    for module in modules:
+        wall, cumulative = [], []
+        for _ in range(args.runs):
+            elapsed, stderr = _run(f"import {module}", env, importtime=True)
+            wall.append(max(elapsed - baseline, 0.0))
+            rows = parse_importtime(stderr)
+            cumulative.append(next(c for name, _, c, depth in reversed(rows)
+                                   if name == module and depth == 0) / 1e6)
+        results[f"{module}[wall]"] = summarize(wall)
+        results[f"{module}[import]"] = summarize(cumulative)
+        # Direct imports of the module in the last run, slowest first
+        direct, inside = [], False
+        for name, _, c, depth in reversed(rows):
+            if depth == 0:
+                inside = name == module
+            elif inside and depth == 1:
+                direct.append((name, c / 1e6))
+        slowest[module] = sorted(direct, key=lambda item: -item[1])[:args.top]
+
+    print_table(results)
+    for module, imports in slowest.items():
+        print(f"\nSlowest imports of {module}:")
+        for name, seconds in imports:
+            print(f"  {name:<40} {seconds * 1e3:8.1f}ms")
+    path = write_result("startup", {"runs": args.runs, "benchmarks": results,
+                                    "slowest_imports": slowest}, args.output)
+    print(f"Results written to {path}")
+
+
+if __name__ == "__main__":
+    main()
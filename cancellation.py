@@ -0,0 +1,155 @@
+import logging
+import threading
+from concurrent.futures import TimeoutError as FutureTimeout
+
+# How often a job blocked on other threads' work re-checks its token
+CANCEL_POLL_INTERVAL = 0.1
+
+# progress_step of a cancelled job whose run may still be stopping, and of
+# one that has stopped or never started
+STOPPING_STEP = "Cancelling"
+CANCELLED_STEP = "Cancelled by user"
+
+
+class JobCancelled(Exception):
+    """Raised inside a job once its cancellation token is set."""
+
+
+class CancellationToken:
+    """Cooperative cancellation signal of one running job.
+
+    Long-running work calls check() between steps, and code blocked on I/O
+    registers an on_cancel() callback that aborts it (e.g. closing an HTTP
+    stream) so the blocked call fails at once.
+    """
+
+    def __init__(self, job_id):
+        self.job_id = job_id
+        self._event = threading.Event()
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    @property
+    def cancelled(self):
+        return self._event.is_set()
+
+    def cancel(self):
+        with self._lock:
+            if self._event.is_set():
+                return
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        logging.info("Cancelling job %s", self.job_id)
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                logging.warning("Cancel callback of job %s failed: %s", self.job_id, e)
+
+    def check(self):
+        if self._event.is_set():
+            raise JobCancelled(f"Job {self.job_id} was cancelled")
+
+    def wait(self, timeout=None):
+        """Sleep up to timeout seconds; returns True if cancelled meanwhile."""
+        return self._event.wait(timeout)
+
+    def wait_for(self, future):
+        """future.result(), but raise JobCancelled as soon as the token is set."""
+        while True:
+            self.check()
+            try:
+                return future.result(timeout=CANCEL_POLL_INTERVAL)
+            except FutureTimeout:
+                continue
+
+    def on_cancel(self, callback):
+        """Run callback when cancelled (at once if already cancelled).
+
+        Returns a function that unregisters the callback.
+        """
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+                return lambda: self._discard(callback)
+        callback()
+        return lambda: None
+
+    def _discard(self, callback):
+        with self._lock:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
+
+
+_tokens = {}  # job_id -> CancellationToken of jobs running in this process
+_tokens_lock = threading.Lock()
+_hook_installed = False
+
+
+def _on_event(job_id, payload):
+    if payload.get("status") == "cancelled":
+        cancel_local(job_id)
+
+
+def register(job_id):
+    """Create the token of a job starting in this process.
+
+    The token is cancelled by cancel_job() from any process: directly when
+    the job runs here, otherwise through the event broker.
+    """
+    global _hook_installed
+    from events import broker
+
+    with _tokens_lock:
+        if not _hook_installed:
+            broker.add_hook(_on_event)
+            _hook_installed = True
+        token = _tokens[job_id] = CancellationToken(job_id)
+    return token
+
+
+def unregister(token):
+    """Forget a token created by register(), unless a newer run of the same
+    job (e.g. a retry) has registered its own since."""
+    with _tokens_lock:
+        if _tokens.get(token.job_id) is token:
+            del _tokens[token.job_id]
+
+
+def cancel_local(job_id):
+    """Cancel a job if it runs in this process; returns True if it did."""
+    with _tokens_lock:
+        token = _tokens.get(job_id)
+    if token is None:
+        return False
+    token.cancel()
+    return True
+
+
+def mark_stopped(job_id):
+    """Record that the run of a cancelled job has stopped, so it can be
+    retried at once rather than after its lease expires."""
+    from sqlalchemy import update
+    from app import app, db
+    from models import Worksheet
+
+    with app.app_context():
+        db.session.execute(
+            update(Worksheet)
+            .where(Worksheet.id == job_id)
+            .where(Worksheet.status == "cancelled")
+            .where(Worksheet.progress_step == STOPPING_STEP)
+            .values(progress_step=CANCELLED_STEP)
+        )
+        db.session.commit()
+
+
+def cancel_job(job_id, payload):
+    """Signal a job whose row was just marked cancelled, wherever it runs.
+
+    payload is its new status payload, also delivered to event streams.
+    """
+    from events import broker
+
+    cancel_local(job_id)
+    broker.publish(job_id, payload)
@@ -0,0 +1,42 @@
+import os
+import threading
+
+# Shared service clients, created on first use rather than at import. Each
+# keeps a pool of keep-alive connections that every caller in the process
+# reuses. Clients are per process: one forked after a client was created
+# builds its own instead of sharing the parent's sockets.
+OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY")
+
+_clients = {}  # (name, pid) -> client
+_lock = threading.Lock()
+
+
+def _shared(name, create):
+    key = (name, os.getpid())
+    client = _clients.get(key)
+    if client is None:
+        with _lock:
+            client = _clients.get(key)
+            if client is None:
+                client = _clients[key] = create()
+    return client
+
+
+def openai_client():
+    """The process's OpenAI client (honours OPENAI_BASE_URL)."""
+    def create():
+        from openai import OpenAI
+        return OpenAI(api_key=OPENAI_API_KEY)
+    return _shared("openai", create)
+
+
+def supabase_client():
+    """The process's Supabase client."""
+    def create():
+        from supabase import create_client
+        url = os.environ.get("SUPABASE_URL")
+        key = os.environ.get("SUPABASE_SERVICE_KEY")
+        if not url or not key:
+            raise RuntimeError("SUPABASE_URL and SUPABASE_SERVICE_KEY must be set")
+        return create_client(url, key)
+    return _shared("supabase", create)
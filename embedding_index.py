@@ -0,0 +1,365 @@
+import os
+import time
+import fcntl
+import logging
+import threading
+from datetime import datetime, timedelta
+
+import numpy as np
+
+# Backend for worksheet topic similarity search: "numpy" keeps a memory-mapped
+# float32 matrix on local disk, "pgvector" searches inside Postgres.
+EMBEDDING_INDEX_BACKEND = os.environ.get("EMBEDDING_INDEX_BACKEND", "numpy")
+# Kept out of worksheets/, which is served over HTTP: the index lists every
+# worksheet id
+EMBEDDING_INDEX_PATH = os.environ.get("EMBEDDING_INDEX_PATH", "var/embedding_index")
+# text-embedding-3 vectors can be truncated and renormalized with little loss.
+# 256 dims keeps a 1M-row matrix at 1 GB, so a top-k scan stays memory-bandwidth
+# bound in the tens of milliseconds instead of reading 6 GB per query.
+EMBEDDING_INDEX_DIM = int(os.environ.get("EMBEDDING_INDEX_DIM", "256"))
+# A numpy index is per host; embeddings stored by other hosts are pulled from
+# the worksheets table in the background at most this often (seconds)
+EMBEDDING_INDEX_SYNC_INTERVAL = float(os.environ.get("EMBEDDING_INDEX_SYNC_INTERVAL", "5"))
+# Rows whose transaction committed up to this long after their timestamp are
+# still picked up by the next sync (seconds)
+EMBEDDING_INDEX_SYNC_OVERLAP = 60
+
+
+def prepare_vector(vector, dim=EMBEDDING_INDEX_DIM):
+    """Truncate to the index dimension and L2-normalize as float32."""
+    v = np.asarray(vector, dtype=np.float32)[:dim]
+    norm = np.linalg.norm(v)
+    return v / norm if norm else v
+
+
+class EmbeddingIndex:
+    """Interface shared by the index backends. Scores are cosine similarities."""
+
+    def add(self, item_id, vector):
+        raise NotImplementedError
+
+    def add_many(self, items):
+        for item_id, vector in items:
+            self.add(item_id, vector)
+
+    def search(self, vector, k=10):
+        """Return up to k (item_id, score) pairs, best first."""
+        raise NotImplementedError
+
+    def __contains__(self, item_id):
+        raise NotImplementedError
+
+    def __len__(self):
+        raise NotImplementedError
+
+
+class NumpyEmbeddingIndex(EmbeddingIndex):
+    """Append-only matrix of unit vectors in a memory-mapped file.
+
+    Rows live in vectors.f32, their ids one per line in ids.txt. A row only
+    counts once its id line is written, so a crash mid-append is harmless.
+    Writers from several processes serialize on a lock file; readers pick up
+    rows appended by other processes before every search.
+    """
+
+    def __init__(self, path=EMBEDDING_INDEX_PATH, dim=EMBEDDING_INDEX_DIM):
+        self.path = path
+        self.dim = dim
+        self._vectors_path = os.path.join(path, "vectors.f32")
+        self._ids_path = os.path.join(path, "ids.txt")
+        self._lock_path = os.path.join(path, "lock")
+        self._synced_path = os.path.join(path, "synced_at")
+        self._lock = threading.RLock()
+        self._ids = []
+        self._positions = {}
+        self._ids_offset = 0
+        self._matrix = None
+        os.makedirs(path, exist_ok=True)
+        with self._lock:
+            self._refresh()
+
+    def __len__(self):
+        with self._lock:
+            self._refresh()
+            return len(self._ids)
+
+    def __contains__(self, item_id):
+        with self._lock:
+            self._refresh()
+            return item_id in self._positions
+
+    def _capacity(self):
+        if not os.path.exists(self._vectors_path):
+            return 0
+        return os.path.getsize(self._vectors_path) // (4 * self.dim)
+
+    def _map(self):
+        capacity = self._capacity()
+        self._matrix = (
+            np.memmap(self._vectors_path, dtype=np.float32, mode="r+", shape=(capacity, self.dim))
+            if capacity else None
+        )
+
+    def _refresh(self):
+        """Load ids (and remap the matrix) appended since the last call."""
+        if not os.path.exists(self._ids_path):
+            return
+        if os.path.getsize(self._ids_path) == self._ids_offset:
+            return
+        with open(self._ids_path, "r") as f:
+            f.seek(self._ids_offset)
+            chunk = f.read()
+        # Ignore a trailing partial line from a writer that is mid-append
+        complete = chunk[:chunk.rfind("\n") + 1]
+        for item_id in complete.splitlines():
+            self._positions[item_id] = len(self._ids)
+            self._ids.append(item_id)
+        self._ids_offset += len(complete.encode("utf-8"))
+        if self._matrix is None or self._matrix.shape[0] < len(self._ids):
+            self._map()
+
+    def _ensure_capacity(self, rows):
+        capacity = self._capacity()
+        if rows <= capacity:
+            if self._matrix is None or self._matrix.shape[0] < capacity:
+                self._map()
+            return
+        new_capacity = max(rows, capacity * 2, 1024)
+        with open(self._vectors_path, "ab") as f:
+            f.truncate(new_capacity * 4 * self.dim)
+        self._map()
+
+    def add(self, item_id, vector):
+        self.add_many([(item_id, vector)])
+
+    def add_many(self, items):
+        with self._lock, open(self._lock_path, "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                self._refresh()
+                new = [(i, v) for i, v in dict(items).items() if i not in self._positions]
+                if not new:
+                    return
+                start = len(self._ids)
+                self._ensure_capacity(start + len(new))
+                for row, (_, vector) in enumerate(new, start):
+                    self._matrix[row] = prepare_vector(vector, self.dim)
+                self._matrix.flush()
+                with open(self._ids_path, "a") as f:
+                    f.write("".join(f"{item_id}\n" for item_id, _ in new))
+                self._refresh()
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def synced_at(self):
+        """Database time up to which the worksheets table has been synced, or
+        None if it never has."""
+        try:
+            with open(self._synced_path) as f:
+                return datetime.fromisoformat(f.read().strip())
+        except (OSError, ValueError):
+            return None
+
+    def set_synced_at(self, value):
+        tmp_path = f"{self._synced_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(value.isoformat())
+        os.replace(tmp_path, self._synced_path)
+
+    def search(self, vector, k=10):
+        with self._lock:
+            self._refresh()
+            n = len(self._ids)
+            if not n:
+                return []
+            matrix, ids = self._matrix[:n], self._ids
+        scores = matrix @ prepare_vector(vector, self.dim)
+        k = min(k, n)
+        top = np.argpartition(scores, n - k)[n - k:]
+        top = top[np.argsort(scores[top])[::-1]]
+        return [(ids[i], float(scores[i])) for i in top]
+
+
+class PgvectorEmbeddingIndex(EmbeddingIndex):
+    """Same interface backed by a pgvector table with an HNSW cosine index."""
+
+    def __init__(self, dim=EMBEDDING_INDEX_DIM):
+        self.dim = dim
+        self._ready = False
+
+    def _setup(self):
+        from sqlalchemy import text
+        from app import db
+
+        if self._ready:
+            return
+        with db.engine.begin() as conn:
+            conn.execute(text("CREATE EXTENSION IF NOT EXISTS vector"))
+            conn.execute(text(
+                "CREATE TABLE IF NOT EXISTS worksheet_embeddings ("
+                "id VARCHAR(36) PRIMARY KEY REFERENCES worksheets(id) ON DELETE CASCADE, "
+                f"embedding vector({self.dim}) NOT NULL)"
+            ))
+            conn.execute(text(
+                "CREATE INDEX IF NOT EXISTS worksheet_embeddings_hnsw "
+                "ON worksheet_embeddings USING hnsw (embedding vector_cosine_ops)"
+            ))
+        self._ready = True
+
+    def _literal(self, vector):
+        return "[" + ",".join(f"{x:.7g}" for x in prepare_vector(vector, self.dim)) + "]"
+
+    def __len__(self):
+        from sqlalchemy import text
+        from app import db
+
+        self._setup()
+        return db.session.execute(text("SELECT count(*) FROM worksheet_embeddings")).scalar()
+
+    def __contains__(self, item_id):
+        from sqlalchemy import text
+        from app import db
+
+        self._setup()
+        return db.session.execute(
+            text("SELECT 1 FROM worksheet_embeddings WHERE id = :id"), {"id": item_id}
+        ).first() is not None
+
+    def add_many(self, items):
+        from sqlalchemy import text
+        from app import db
+
+        self._setup()
+        rows = [{"id": i, "embedding": self._literal(v)} for i, v in items]
+        if not rows:
+            return
+        with db.engine.begin() as conn:
+            conn.execute(
+                text(
+                    "INSERT INTO worksheet_embeddings (id, embedding) "
+                    "VALUES (:id, CAST(:embedding AS vector)) ON CONFLICT (id) DO NOTHING"
+                ),
+                rows,
+            )
+
+    def add(self, item_id, vector):
+        self.add_many([(item_id, vector)])
+
+    def search(self, vector, k=10):
+        from sqlalchemy import text
+        from app import db
+
+        self._setup()
+        result = db.session.execute(
+            text(
+                "SELECT id, 1 - (embedding <=> CAST(:q AS vector)) AS score "
+                "FROM worksheet_embeddings ORDER BY embedding <=> CAST(:q AS vector) LIMIT :k"
+            ),
+            {"q": self._literal(vector), "k": k},
+        )
+        return [(row.id, float(row.score)) for row in result]
+
+
+_index = None
+_index_lock = threading.Lock()
+_sync_thread = None
+_next_sync = 0.0
+
+
+def get_index():
+    """Return this process's embedding index, and start a background sync
+    with the worksheets table if one is due."""
+    global _index
+    with _index_lock:
+        if _index is None:
+            if EMBEDDING_INDEX_BACKEND == "pgvector":
+                _index = PgvectorEmbeddingIndex()
+            else:
+                _index = NumpyEmbeddingIndex()
+        _request_sync()
+        return _index
+
+
+def _request_sync():
+    global _sync_thread, _next_sync
+    now = time.monotonic()
+    if now < _next_sync or (_sync_thread is not None and _sync_thread.is_alive()):
+        return
+    if EMBEDDING_INDEX_BACKEND == "pgvector":
+        # The table is shared by every host; it only needs a backfill
+        _next_sync = float("inf")
+    else:
+        _next_sync = now + EMBEDDING_INDEX_SYNC_INTERVAL
+    _sync_thread = threading.Thread(target=_sync, args=(_index,), name="embedding-index-sync", daemon=True)
+    _sync_thread.start()
+
+
+def _sync(index):
+    from sqlalchemy import func
+    from app import app, db
+
+    try:
+        with app.app_context():
+            if isinstance(index, PgvectorEmbeddingIndex):
+                if len(index) == 0:
+                    sync_from_db(index)
+                return
+            started = db.session.query(func.now()).scalar()
+            since = index.synced_at()
+            if since is not None:
+                since -= timedelta(seconds=EMBEDDING_INDEX_SYNC_OVERLAP)
+            sync_from_db(index, since)
+            index.set_synced_at(started)
+    except Exception as e:
+        # Searches go on with what the index has; the next one retries
+        logging.error("Failed to sync the embedding index: %s", e)
+
+
+def sync_from_db(index, since=None, batch_size=1000):
+    """Add the stored worksheet embeddings missing from the index, only
+    looking at rows written after since if it is given."""
+    from sqlalchemy import func
+    from models import Worksheet
+    from app import db
+
+    query = (
+        db.session.query(Worksheet.id, Worksheet.embedding)
+        .filter(Worksheet.embedding.isnot(None))
+        .execution_options(yield_per=batch_size)
+    )
+    if since is not None:
+        query = query.filter(func.coalesce(Worksheet.updated_at, Worksheet.created_at) > since)
+    batch, added = [], 0
+    for item_id, embedding in query:
+        if item_id in index:
+            continue
+        batch.append((item_id, embedding))
+        if len(batch) >= batch_size:
+            index.add_many(batch)
+            added += len(batch)
+            batch = []
+    if batch:
+        index.add_many(batch)
+        added += len(batch)
+    if added:
+        logging.info("Added %s worksheet embeddings to the index", added)
+    return added
+
+
+def index_worksheet(worksheet_id, embedding):
+    """Keep the index in sync when a worksheet embedding is stored."""
+    if embedding is None:
+        return
+    index_worksheets([(worksheet_id, embedding)])
+
+
+def index_worksheets(items):
+    """Add several (worksheet_id, embedding) pairs to the index at once."""
+    items = [(i, e) for i, e in items if e is not None]
+    if not items:
+        return
+    try:
+        get_index().add_many(items)
+    except Exception as e:
+        # The index can always be rebuilt from the worksheets table
+        logging.error("Failed to index embeddings of %s worksheet(s): %s", len(items), e)
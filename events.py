@@ -0,0 +1,122 @@
+import os
+import json
+import time
+import queue
+import select
+import logging
+import threading
+
+# "memory" delivers events only within this process (a single app process
+# running jobs in threads). "postgres" fans them out with LISTEN/NOTIFY so any
+# gunicorn worker can serve the stream of a job another process is running.
+EVENTS_BACKEND = os.environ.get("EVENTS_BACKEND", "memory")
+EVENTS_CHANNEL = "worksheet_events"
+
+TERMINAL_STATUSES = {"done", "error", "cancelled"}
+
+
+class EventBroker:
+    """Per-job publish/subscribe of worksheet status updates."""
+
+    def __init__(self, backend=EVENTS_BACKEND):
+        self.backend = backend
+        self._subscribers = {}  # job_id -> set of queue.Queue
+        self._hooks = []
+        self._lock = threading.Lock()
+        self._listener = None
+
+    def subscribe(self, job_id):
+        """Return a queue that receives every status update for job_id."""
+        if self.backend == "postgres":
+            self._ensure_listener()
+        q = queue.Queue()
+        with self._lock:
+            self._subscribers.setdefault(job_id, set()).add(q)
+        return q
+
+    def unsubscribe(self, job_id, q):
+        with self._lock:
+            subscribers = self._subscribers.get(job_id)
+            if subscribers:
+                subscribers.discard(q)
+                if not subscribers:
+                    del self._subscribers[job_id]
+
+    def add_hook(self, callback):
+        """Call callback(job_id, payload) for every update reaching this
+        process, whether or not the job has subscribers."""
+        with self._lock:
+            self._hooks.append(callback)
+        if self.backend == "postgres":
+            self._ensure_listener()
+
+    def publish(self, job_id, payload):
+        """Send a status payload to every subscriber of job_id."""
+        if self.backend == "postgres":
+            try:
+                self._notify(job_id, payload)
+                return
+            except Exception as e:
+                logging.error("Failed to publish event for %s: %s", job_id, e)
+        self._deliver(job_id, payload)
+
+    def _deliver(self, job_id, payload):
+        with self._lock:
+            subscribers = list(self._subscribers.get(job_id, ()))
+            hooks = list(self._hooks)
+        for q in subscribers:
+            q.put(payload)
+        for hook in hooks:
+            try:
+                hook(job_id, payload)
+            except Exception as e:
+                logging.error("Event hook failed for %s: %s", job_id, e)
+
+    def _notify(self, job_id, payload):
+        from sqlalchemy import text
+        from app import db
+
+        message = json.dumps({"job_id": job_id, "payload": payload})
+        with db.engine.begin() as conn:
+            conn.execute(text("SELECT pg_notify(:channel, :message)"),
+                         {"channel": EVENTS_CHANNEL, "message": message})
+
+    def _ensure_listener(self):
+        with self._lock:
+            if self._listener is None or not self._listener.is_alive():
+                self._listener = threading.Thread(
+                    target=self._listen_loop, name="worksheet-events", daemon=True
+                )
+                self._listener.start()
+
+    def _listen_loop(self):
+        """Relay NOTIFY messages to local subscribers, reconnecting on failure."""
+        from app import app, db
+
+        while True:
+            try:
+                with app.app_context():
+                    conn = db.engine.raw_connection()
+                try:
+                    dbapi_conn = conn.driver_connection
+                    dbapi_conn.autocommit = True
+                    with dbapi_conn.cursor() as cursor:
+                        cursor.execute(f"LISTEN {EVENTS_CHANNEL}")
+                    while True:
+                        if select.select([dbapi_conn], [], [], 60) == ([], [], []):
+                            continue
+                        dbapi_conn.poll()
+                        while dbapi_conn.notifies:
+                            notify = dbapi_conn.notifies.pop(0)
+                            message = json.loads(notify.payload)
+                            self._deliver(message["job_id"], message["payload"])
+                finally:
+                    # LISTEN and autocommit stay on the connection; close it
+                    # rather than hand it back to the pool
+                    conn.invalidate()
+            except Exception as e:
+                logging.error("Event listener failed, reconnecting: %s", e)
+                time.sleep(1)
+
+
+broker = EventBroker()
@@ -1,15 +1,9 @@
-import json
 import os
 import logging
 
-import requests
 from app import db
 from flask import Blueprint, redirect, request, url_for, session, flash
 from flask_login import login_required, login_user, logout_user
-from models import User
-from google_auth_oauthlib.flow import Flow
-import google.auth.transport.requests
-from google.oauth2 import id_token
 
 GOOGLE_CLIENT_ID = os.environ.get("GOOGLE_OAUTH_CLIENT_ID")
 GOOGLE_CLIENT_SECRET = os.environ.get("GOOGLE_OAUTH_CLIENT_SECRET")
@@ -17,12 +11,10 @@ GOOGLE_CLIENT_SECRET = os.environ.get("GOOGLE_OAUTH_CLIENT_SECRET")
 # Redirect URL must match the one configured in your Google Cloud Console
 REDIRECT_URL = os.environ.get("GOOGLE_REDIRECT_URL", "http://localhost:5000/google_login/callback")
 
-# ALWAYS display setup instructions to the user:
-print(f"""To make Google authentication work:
+SETUP_INSTRUCTIONS = f"""To make Google authentication work:
 1. Go to https://console.cloud.google.com/apis/credentials
 2. Create a new OAuth 2.0 Client ID
-3. Add {REDIRECT_URL} to Authorized redirect URIs
-""")
+3. Add {REDIRECT_URL} to Authorized redirect URIs"""
 
 # Allow insecure transport for local development
 os.environ["OAUTHLIB_INSECURE_TRANSPORT"] = "1"
@@ -31,6 +23,11 @@ google_auth = Blueprint("google_auth", __name__)
 
 def get_flow():
     """Create and return a Flow object for Google OAuth"""
+    # Imported on the first login rather than at app startup
+    from google_auth_oauthlib.flow import Flow
+    
+    if not GOOGLE_CLIENT_ID or not GOOGLE_CLIENT_SECRET:
+        logging.warning("Google OAuth is not configured. %s", SETUP_INSTRUCTIONS)
     flow = Flow.from_client_config(
         {
             "web": {
@@ -59,17 +56,20 @@ def login():
         session["state"] = state
         return redirect(authorization_url)
     except Exception as e:
-        logging.error(f"Google login error: {e}")
+        logging.error("Google login error: %s", e)
         flash("Error initiating Google login. Please try again.", "error")
         return redirect(url_for("index"))
 
 @google_auth.route("/google_login/callback")
 def callback():
+    import requests
+    from models import User
+    
     try:
         # Check for error in the callback
         if "error" in request.args:
             error = request.args.get("error")
-            logging.error(f"Google OAuth error: {error}")
+            logging.error("Google OAuth error: %s", error)
             flash("Authentication was cancelled or failed. Please try again.", "error")
             return redirect(url_for("index"))
         
@@ -95,7 +95,6 @@ def callback():
         
         # Get user info
         credentials = flow.credentials
-        request_session = google.auth.transport.requests.Request()
         
         # Get user info from Google's userinfo endpoint
         userinfo_endpoint = "https://openidconnect.googleapis.com/v1/userinfo"
@@ -105,7 +104,7 @@ def callback():
         )
         
         if userinfo_response.status_code != 200:
-            logging.error(f"Failed to get user info: {userinfo_response.status_code}")
+            logging.error("Failed to get user info: %s", userinfo_response.status_code)
             flash("Failed to get user information from Google.", "error")
             return redirect(url_for("index"))
         
@@ -129,10 +128,10 @@ def callback():
                 user = User(username=name, email=email)
                 db.session.add(user)
                 db.session.commit()
-                logging.info(f"Created new user: {email}")
+                logging.info("Created new user: %s", email)
             except IntegrityError:
                 db.session.rollback()
-                logging.error(f"Failed to create user {email} - integrity error")
+                logging.error("Failed to create user %s - integrity error", email)
                 flash("Error creating user account.", "error")
                 return redirect(url_for("index"))
         
@@ -140,13 +139,12 @@ def callback():
         login_user(user, remember=True)
         session.pop("state", None)  # Clean up session
         
-        logging.info(f"User logged in successfully: {email}, user_id: {user.id}")
-        logging.info(f"Session after login: {session}")
-        logging.info(f"Current user authenticated: {user.is_authenticated}")
+        logging.info("User logged in successfully: %s, user_id: %s", email, user.id)
+        logging.info("Current user authenticated: %s", user.is_authenticated)
         return redirect(url_for("index"))
         
     except Exception as e:
-        logging.error(f"Google OAuth callback error: {e}")
+        logging.error("Google OAuth callback error: %s", e)
         flash("Login failed. Please try again.", "error")
         return redirect(url_for("index"))
 
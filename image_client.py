@@ -1,19 +1,24 @@
 import os
 import logging
-import requests
-from openai import OpenAI
+from clients import openai_client
 
 # the newest OpenAI model is "gpt-4o" which was released May 13, 2024.
 # do not change this unless explicitly requested by the user
-OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY")
-openai_client = OpenAI(api_key=OPENAI_API_KEY)
 
-def generate_line_art_image(description):
-    """Generate a black and white line art image using OpenAI."""
+# Part of the image store's content key: changing the prompt invalidates
+# previously stored images
+LINE_ART_PROMPT = "Generate a black and white line art drawing, simple coloring book style: {description}. Clean lines, no shading, suitable for educational worksheets."
+
+def generate_line_art_image(description, fallback=True):
+    """Generate a black and white line art image using OpenAI.
+
+    On failure a generic placeholder is returned, or the error is raised if
+    fallback is False.
+    """
     try:
-        prompt = f"Generate a black and white line art drawing, simple coloring book style: {description}. Clean lines, no shading, suitable for educational worksheets."
+        prompt = LINE_ART_PROMPT.format(description=description)
         
-        response = openai_client.responses.create(
+        response = openai_client().responses.create(
             model="gpt-4.1",
             tools=[{"type": "dalle"}],
             input=prompt
@@ -28,13 +33,18 @@ def generate_line_art_image(description):
         return svg_content.encode('utf-8')
             
     except Exception as e:
-        logging.error(f"Failed to generate image: {e}")
-        # Return placeholder SVG on error
-        svg_content = f'''<svg width="200" height="150" xmlns="http://www.w3.org/2000/svg">
+        logging.error("Failed to generate image: %s", e)
+        if not fallback:
+            raise
+        return placeholder_image()
+
+def placeholder_image():
+    """Generic placeholder SVG used when image generation fails."""
+    svg_content = f'''<svg width="200" height="150" xmlns="http://www.w3.org/2000/svg">
             <rect width="200" height="150" fill="white" stroke="black" stroke-width="2"/>
             <text x="100" y="75" text-anchor="middle" font-family="Arial" font-size="12" fill="black">Image</text>
         </svg>'''
-        return svg_content.encode('utf-8')
+    return svg_content.encode('utf-8')
 
 def save_image(image_data, file_path):
     """Save image data to file."""
@@ -44,5 +54,5 @@ def save_image(image_data, file_path):
             f.write(image_data)
         return file_path
     except Exception as e:
-        logging.error(f"Failed to save image: {e}")
+        logging.error("Failed to save image: %s", e)
         raise
@@ -0,0 +1,187 @@
+import os
+import time
+import hashlib
+import logging
+import threading
+from concurrent.futures import Future
+
+from metrics import CACHE_TOTAL
+
+# Content-addressed store of generated images shared by all jobs. An image is
+# keyed by its normalized description and the generation prompt, generated
+# once and referenced by every job that needs it.
+IMAGE_STORE_DIR = os.environ.get("IMAGE_STORE_DIR", "worksheets/.images")
+IMAGE_STORE_MAX_BYTES = int(os.environ.get("IMAGE_STORE_MAX_BYTES", str(2 * 1024 ** 3)))
+# Files used (by any process) within this many seconds are never evicted
+IMAGE_STORE_EVICT_GRACE = int(os.environ.get("IMAGE_STORE_EVICT_GRACE", "3600"))
+
+
+def image_key(description, prompt):
+    normalized = " ".join(description.split()).lower()
+    return hashlib.sha256(f"{prompt}\n{normalized}".encode("utf-8")).hexdigest()
+
+
+class ImageStore:
+    """Deduplicating on-disk image store with an in-memory index.
+
+    Last use is tracked through file mtimes so LRU eviction agrees across
+    processes. Jobs pin the images they use (reference counting) and pinned
+    images are never evicted.
+    """
+
+    def __init__(self, root=IMAGE_STORE_DIR, max_bytes=IMAGE_STORE_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._index = {}  # key -> size in bytes
+        self._refs = {}  # key -> number of jobs using it
+        self._inflight = {}  # key -> Future of the path, for single-flight generation
+        self._uploaded = set()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        self._load()
+
+    def _path(self, key):
+        return os.path.join(self.root, key[:2], f"{key}.png")
+
+    def _load(self):
+        if not os.path.isdir(self.root):
+            return
+        for dirpath, _, filenames in os.walk(self.root):
+            for name in filenames:
+                if name.endswith(".png"):
+                    size = os.path.getsize(os.path.join(dirpath, name))
+                    self._index[name[:-4]] = size
+                    self._total_bytes += size
+        logging.info("Image store loaded %s images (%s bytes)", len(self._index), self._total_bytes)
+
+    def get_or_generate(self, description, prompt, generate):
+        """Return the stored image path for description, calling generate()
+        (which returns image bytes) only if it has never been generated.
+        The caller holds a reference until release() is called; if this
+        raises, no reference is held, so the caller may simply retry."""
+        key = image_key(description, prompt)
+        path = self._path(key)
+        with self._lock:
+            self._refs[key] = self._refs.get(key, 0) + 1
+            if key not in self._index and os.path.exists(path):
+                # Stored by another process since we loaded
+                self._add(key, os.path.getsize(path))
+            if key in self._index:
+                owner, future = False, None
+            elif key in self._inflight:
+                owner, future = False, self._inflight[key]
+            else:
+                owner, future = True, Future()
+                self._inflight[key] = future
+
+        CACHE_TOTAL.inc("image", "miss" if owner else "hit")
+        if future is None:
+            self._touch(path)
+            return path
+        if not owner:
+            try:
+                return future.result()
+            except BaseException:
+                self._unref(key)
+                raise
+
+        try:
+            data = generate()
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+            with self._lock:
+                self._add(key, len(data))
+            future.set_result(path)
+        except Exception as e:
+            self._unref(key)
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+        self.evict()
+        return path
+
+    def acquire(self, path):
+        """Take a reference on an image stored earlier, e.g. recorded in a job
+        checkpoint. Returns False if it has been evicted since."""
+        key = os.path.basename(path)[:-4]
+        if self._path(key) != path:
+            return False
+        with self._lock:
+            if key not in self._index:
+                if not os.path.exists(path):
+                    return False
+                self._add(key, os.path.getsize(path))
+            self._refs[key] = self._refs.get(key, 0) + 1
+        self._touch(path)
+        return True
+
+    def release(self, path):
+        """Drop one reference taken by get_or_generate."""
+        self._unref(os.path.basename(path)[:-4])
+
+    def _unref(self, key):
+        with self._lock:
+            if self._refs.get(key, 0) > 1:
+                self._refs[key] -= 1
+            else:
+                self._refs.pop(key, None)
+
+    def needs_upload(self, path):
+        """True the first time this process is asked about an image."""
+        with self._lock:
+            if path in self._uploaded:
+                return False
+            self._uploaded.add(path)
+            return True
+
+    def _add(self, key, size):
+        if key not in self._index:
+            self._index[key] = size
+            self._total_bytes += size
+
+    def _touch(self, path):
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+    def evict(self):
+        """Delete least recently used, unreferenced images above max_bytes."""
+        with self._lock:
+            if self._total_bytes <= self.max_bytes:
+                return 0
+            candidates = [k for k in self._index if not self._refs.get(k)]
+        aged = []
+        for key in candidates:
+            try:
+                aged.append((os.path.getmtime(self._path(key)), key))
+            except OSError:
+                aged.append((0, key))
+        aged.sort()
+        cutoff = time.time() - IMAGE_STORE_EVICT_GRACE
+        evicted = 0
+        for mtime, key in aged:
+            with self._lock:
+                if self._total_bytes <= self.max_bytes:
+                    break
+                if mtime > cutoff or self._refs.get(key):
+                    continue
+                size = self._index.pop(key, 0)
+                self._total_bytes -= size
+                self._uploaded.discard(self._path(key))
+            try:
+                os.remove(self._path(key))
+            except FileNotFoundError:
+                pass
+            evicted += 1
+        if evicted:
+            logging.info("Image store evicted %s images", evicted)
+        return evicted
+
+
+image_store = ImageStore()
@@ -1,10 +1,25 @@
 import os
 import json
 import logging
-from jinja2 import Template
+from jinja2 import Environment, FileSystemLoader, FileSystemBytecodeCache, select_autoescape
+from layout import layout_spec
 
-def generate_interactive_html(spec, job_id, images_data=None):
-    """Generate interactive HTML version of the worksheet."""
+TEMPLATES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "templates")
+
+# Compiled once per process. Templates are only re-checked on disk in debug
+# mode, and compiled bytecode is shared between processes through the cache.
+_env = Environment(
+    loader=FileSystemLoader(TEMPLATES_DIR),
+    bytecode_cache=FileSystemBytecodeCache(os.environ.get("JINJA_BYTECODE_CACHE_DIR")),
+    auto_reload=os.environ.get("FLASK_DEBUG") == "1",
+    autoescape=select_autoescape(["html"]),
+)
+
+def generate_interactive_html(spec, job_id, images_data=None, layout=None):
+    """Generate interactive HTML version of the worksheet.
+
+    Uses the same precomputed layout as the PDF (see layout.layout_spec).
+    """
     try:
         # Create directory for this job
         job_dir = f"worksheets/{job_id}"
@@ -12,26 +27,24 @@ def generate_interactive_html(spec, job_id, images_data=None):
         
         html_path = f"{job_dir}/interactive.html"
         
-        # Read template
-        with open("templates/interactive_template.html", "r") as f:
-            template_content = f.read()
-        
-        template = Template(template_content)
-        
-        # Render HTML
-        html_content = template.render(
-            title=spec.get("title", "Interactive Worksheet"),
-            instructions=spec.get("instructions", ""),
-            elements=spec.get("elements", []),
-            job_id=job_id
-        )
-        
-        # Write HTML file
         with open(html_path, "w") as f:
-            f.write(html_content)
+            render_interactive_html(spec, job_id, f, images_data, layout)
         
         return html_path
         
     except Exception as e:
-        logging.error(f"Failed to create interactive HTML: {e}")
+        logging.error("Failed to create interactive HTML: %s", e)
         raise
+
+def render_interactive_html(spec, job_id, out, images_data=None, layout=None):
+    """Render the interactive worksheet into a writable text stream,
+    without building the whole document in memory."""
+    if layout is None:
+        layout = layout_spec(spec, images_data)
+    
+    template = _env.get_template("interactive_template.html")
+    template.stream(
+        title=spec.get("title", "Interactive Worksheet"),
+        layout=layout,
+        job_id=job_id
+    ).dump(out)
@@ -0,0 +1,290 @@
+import os
+import time
+import atexit
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+from metrics import JOBS_IN_FLIGHT, QUEUE_WAIT_SECONDS
+
+# Worker pool configuration. Each gunicorn process runs its own pool, so the
+# total number of concurrent jobs is WORKER_POOL_SIZE x gunicorn workers.
+WORKER_POOL_SIZE = int(os.environ.get("WORKER_POOL_SIZE", "4"))
+WORKER_POOL_MODE = os.environ.get("WORKER_POOL_MODE", "thread")  # thread|process
+JOB_POLL_INTERVAL = float(os.environ.get("JOB_POLL_INTERVAL", "5"))
+# A job whose row has not been touched for this long is considered orphaned
+# (its worker died) and is put back in the queue.
+JOB_LEASE_SECONDS = int(os.environ.get("JOB_LEASE_SECONDS", "300"))
+
+
+def _init_process_worker():
+    """Drop database connections and metrics inherited from the parent
+    process, and restart the log listener thread, which a fork doesn't copy."""
+    from app import db, app
+    from metrics import registry
+    import log_config
+    log_config.configure(force=True)
+    with app.app_context():
+        db.engine.dispose(close=False)
+    registry.reset()
+    registry.start_flusher()
+
+
+class JobQueue:
+    """Fixed-size worker pool fed from pending rows in the worksheets table."""
+
+    def __init__(self, size=WORKER_POOL_SIZE, mode=WORKER_POOL_MODE):
+        self.size = size
+        self.mode = mode
+        self._executor = None
+        self._dispatcher = None
+        self._slots = threading.BoundedSemaphore(size)
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._running = set()
+        self._running_lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        atexit.register(self.stop)
+
+    @property
+    def started(self):
+        return self._dispatcher is not None and self._dispatcher.is_alive()
+
+    def start(self):
+        """Recover orphaned jobs and start the dispatcher thread."""
+        with self._start_lock:
+            if self.started:
+                return
+            # Never start a pool inside one of our own worker processes
+            if multiprocessing.parent_process() is not None:
+                return
+            if self.mode == "process":
+                from events import broker
+                # Cancellations reach worker processes only as events
+                if broker.backend == "memory":
+                    raise RuntimeError(
+                        "WORKER_POOL_MODE=process needs EVENTS_BACKEND=postgres"
+                    )
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.size, initializer=_init_process_worker
+                )
+            else:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.size, thread_name_prefix="worksheet-job"
+                )
+            self._stopping.clear()
+            self._dispatcher = threading.Thread(
+                target=self._dispatch_loop, name="worksheet-dispatcher", daemon=True
+            )
+            self._dispatcher.start()
+            logging.info("Job queue started with %s %s workers", self.size, self.mode)
+
+    def stop(self):
+        """Stop claiming new jobs. In-flight jobs are recovered by lease expiry."""
+        self._stopping.set()
+        self._wakeup.set()
+        if self._executor:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def notify(self):
+        """Wake the dispatcher because a new job was enqueued. Does nothing
+        if the pool was not started (WORKER_AUTOSTART=0): the job waits for
+        a process whose pool is running to claim it."""
+        if self.started:
+            self._wakeup.set()
+
+    def running_jobs(self):
+        with self._running_lock:
+            return set(self._running)
+
+    def _dispatch_loop(self):
+        from app import app
+
+        with app.app_context():
+            self.recover_orphaned_jobs()
+        last_maintenance = 0.0
+
+        while not self._stopping.is_set():
+            now = time.monotonic()
+            if now - last_maintenance >= min(JOB_POLL_INTERVAL, JOB_LEASE_SECONDS / 3):
+                last_maintenance = now
+                with app.app_context():
+                    self._heartbeat()
+                    self._cancel_revoked_jobs()
+                    self.recover_orphaned_jobs()
+
+            if not self._slots.acquire(timeout=JOB_POLL_INTERVAL):
+                continue
+            try:
+                with app.app_context():
+                    job_id, queue_wait = self.claim_next_job()
+            except Exception as e:
+                logging.error("Failed to claim job: %s", e)
+                job_id = None
+
+            if job_id is None:
+                self._slots.release()
+                self._wakeup.wait(JOB_POLL_INTERVAL)
+                self._wakeup.clear()
+                continue
+
+            self._submit(job_id, queue_wait)
+
+    def _submit(self, job_id, queue_wait=None):
+        from worker import run_generation_job
+
+        with self._running_lock:
+            self._running.add(job_id)
+        try:
+            future = self._executor.submit(run_generation_job, job_id, queue_wait)
+        except Exception as e:
+            logging.error("Failed to submit job %s to worker pool: %s", job_id, e)
+            self._finish(job_id)
+            return
+        future.add_done_callback(lambda f: self._finish(job_id, f))
+        logging.debug("Dispatched job %s to worker pool", job_id)
+
+    def _finish(self, job_id, future=None):
+        with self._running_lock:
+            self._running.discard(job_id)
+        self._slots.release()
+        if future is not None and not future.cancelled() and future.exception():
+            logging.error("Worker crashed running job %s: %s", job_id, future.exception())
+        # A slot is free, check for more work immediately
+        self._wakeup.set()
+
+    def claim_next_job(self):
+        """Atomically move the oldest pending job to in_progress.
+
+        Returns (job_id, seconds it waited since it became pending), or
+        (None, None) if no job is ready.
+        """
+        from sqlalchemy import select, update, func, or_
+        from sqlalchemy.orm import aliased
+        from app import db
+        from models import Worksheet
+        from batches import BATCH_MAX_CONCURRENCY
+
+        # Jobs of a batch only start while fewer than BATCH_MAX_CONCURRENCY of
+        # its jobs are running (a soft limit across processes)
+        sibling = aliased(Worksheet)
+        running_in_batch = (
+            select(func.count())
+            .select_from(sibling)
+            .where(sibling.batch_id == Worksheet.batch_id, sibling.status == "in_progress")
+            .scalar_subquery()
+        )
+        # updated_at was last set when the job became pending
+        next_job = (
+            select(Worksheet.id,
+                   func.coalesce(Worksheet.updated_at, Worksheet.created_at).label("queued_at"))
+            .where(Worksheet.status == "pending")
+            .where(or_(Worksheet.batch_id.is_(None), running_in_batch < BATCH_MAX_CONCURRENCY))
+            .order_by(Worksheet.created_at)
+            .limit(1)
+            .with_for_update(skip_locked=True)
+            .subquery()
+        )
+        stmt = (
+            update(Worksheet)
+            .where(Worksheet.id == next_job.c.id)
+            .values(
+                status="in_progress",
+                progress_step="Starting generation",
+                progress_percent=5,
+                updated_at=func.now(),
+            )
+            .returning(Worksheet.id, func.extract("epoch", func.now() - next_job.c.queued_at))
+        )
+        try:
+            row = db.session.execute(stmt).first()
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        if row is None:
+            return None, None
+        queue_wait = max(float(row[1]), 0.0)
+        QUEUE_WAIT_SECONDS.observe(queue_wait)
+        return row[0], queue_wait
+
+    def recover_orphaned_jobs(self):
+        """Requeue in_progress jobs whose lease expired, e.g. after a restart."""
+        from sqlalchemy import update, func, text
+        from app import db
+        from models import Worksheet
+
+        last_seen = func.coalesce(Worksheet.updated_at, Worksheet.created_at)
+        stmt = (
+            update(Worksheet)
+            .where(Worksheet.status == "in_progress")
+            .where(last_seen < func.now() - text(f"interval '{int(JOB_LEASE_SECONDS)} seconds'"))
+            .values(status="pending", progress_step="Requeued after worker restart", progress_percent=0)
+        )
+        running = self.running_jobs()
+        if running:
+            stmt = stmt.where(Worksheet.id.notin_(running))
+        try:
+            recovered = db.session.execute(stmt).rowcount
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            logging.error("Failed to recover orphaned jobs: %s", e)
+            return 0
+        if recovered:
+            logging.warning("Requeued %s orphaned job(s)", recovered)
+            self._wakeup.set()
+        return recovered
+
+    def _heartbeat(self):
+        """Refresh the lease of every job this process is running."""
+        from sqlalchemy import update, func
+        from app import db
+        from models import Worksheet
+
+        running = self.running_jobs()
+        if not running:
+            return
+        try:
+            db.session.execute(
+                update(Worksheet)
+                .where(Worksheet.id.in_(running))
+                .where(Worksheet.status == "in_progress")
+                .values(updated_at=func.now())
+            )
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            logging.error("Failed to refresh job leases: %s", e)
+
+    def _cancel_revoked_jobs(self):
+        """Signal running jobs whose rows were cancelled by another process.
+
+        A fallback for cancellations that did not arrive as events, e.g. with
+        EVENTS_BACKEND=memory behind several app processes. Only reaches jobs
+        running in threads of this process; process workers are reached by
+        events alone, which is why they require EVENTS_BACKEND=postgres.
+        """
+        from app import db
+        from models import Worksheet
+        from cancellation import cancel_local
+
+        running = self.running_jobs()
+        if not running or self.mode != "thread":
+            return
+        try:
+            cancelled = db.session.query(Worksheet.id).filter(
+                Worksheet.id.in_(running), Worksheet.status == "cancelled"
+            ).all()
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            logging.error("Failed to check for cancelled jobs: %s", e)
+            return
+        for (job_id,) in cancelled:
+            cancel_local(job_id)
+
+
+job_queue = JobQueue()
+JOBS_IN_FLIGHT.function = lambda: len(job_queue.running_jobs())
@@ -0,0 +1,180 @@
+import functools
+
+# Page geometry in points (US letter); the interactive HTML uses the same
+# numbers as px
+PAGE_WIDTH, PAGE_HEIGHT = 612.0, 792.0
+MARGIN = 50
+FRAME_WIDTH = PAGE_WIDTH - 2 * MARGIN
+FRAME_BOTTOM = PAGE_HEIGHT - MARGIN
+ELEMENT_SPACING = 12
+
+TITLE_FONT, TITLE_SIZE = "Helvetica-Bold", 16
+BODY_FONT, BOLD_FONT = "Helvetica", "Helvetica-Bold"
+INSTRUCTIONS_SIZE, INSTRUCTIONS_LEADING = 10, 15
+PLACEHOLDER_FONT, PLACEHOLDER_SIZE = "Helvetica", 10
+
+
+@functools.lru_cache(maxsize=None)
+def _width_table(font_name):
+    """Per-font widths of the Latin-1 range at size 1; other characters are
+    measured on first use and added."""
+    from reportlab.pdfbase import pdfmetrics
+    return {chr(i): pdfmetrics.stringWidth(chr(i), font_name, 1) for i in range(256)}
+
+
+@functools.lru_cache(maxsize=None)
+def _ascent(font_name):
+    from reportlab.pdfbase import pdfmetrics
+    return pdfmetrics.getAscent(font_name, 1)
+
+
+def text_width(text, font_name, size):
+    """Width of text in points, using the cached width table of the font."""
+    table = _width_table(font_name)
+    total = 0.0
+    for ch in text:
+        width = table.get(ch)
+        if width is None:
+            from reportlab.pdfbase import pdfmetrics
+            width = table[ch] = pdfmetrics.stringWidth(ch, font_name, 1)
+        total += width
+    return total * size
+
+
+def wrap_text(text, font_name, size, max_width):
+    """Greedy word wrap by measured width. Words wider than a line are split."""
+    lines = []
+    space = text_width(" ", font_name, size)
+    for paragraph in str(text).split("\n"):
+        line, line_width = [], 0.0
+        for word in paragraph.split():
+            word_width = text_width(word, font_name, size)
+            while word_width > max_width:
+                # Hard-break an overlong word at the last character that fits
+                if line:
+                    lines.append(" ".join(line))
+                    line, line_width = [], 0.0
+                cut = 1
+                while cut < len(word) and text_width(word[:cut + 1], font_name, size) <= max_width:
+                    cut += 1
+                lines.append(word[:cut])
+                word = word[cut:]
+                word_width = text_width(word, font_name, size)
+            if not word:
+                continue
+            needed = word_width if not line else line_width + space + word_width
+            if line and needed > max_width:
+                lines.append(" ".join(line))
+                line, line_width = [word], word_width
+            else:
+                line.append(word)
+                line_width = needed
+        lines.append(" ".join(line))
+    return lines
+
+
+class _Flow:
+    """Places boxes top to bottom in the page frame, starting new pages as needed."""
+
+    def __init__(self):
+        self.pages = [[]]
+        self.y = MARGIN
+
+    def new_page(self):
+        self.pages.append([])
+        self.y = MARGIN
+
+    def place(self, box, height):
+        if self.y + height > FRAME_BOTTOM and self.y > MARGIN:
+            self.new_page()
+        box["y"] = self.y
+        box["height"] = height
+        box["page"] = len(self.pages) - 1
+        self.pages[-1].append(box)
+        self.y += height + ELEMENT_SPACING
+
+    def place_text(self, box, lines, leading):
+        """Place a text block, splitting its lines across pages if necessary."""
+        while lines:
+            fits = int((FRAME_BOTTOM - self.y) // leading)
+            if fits <= 0:
+                self.new_page()
+                continue
+            part = dict(box, lines=lines[:fits], leading=leading)
+            self.place(part, len(part["lines"]) * leading)
+            lines = lines[fits:]
+            if lines:
+                self.new_page()
+
+
+def _clamp(value, low, high, default):
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return default
+    return max(low, min(high, value))
+
+
+def layout_spec(spec, images_data=None):
+    """Compute page layout of a worksheet spec once for both the PDF and the
+    interactive HTML. Returns a JSON-serializable dict of pages of boxes with
+    top-left coordinates in points."""
+    flow = _Flow()
+
+    title = spec.get("title", "Worksheet")
+    flow.place_text(
+        {"kind": "title", "x": MARGIN, "width": FRAME_WIDTH, "font": TITLE_FONT,
+         "size": TITLE_SIZE, "ascent": _ascent(TITLE_FONT) * TITLE_SIZE},
+        wrap_text(title, TITLE_FONT, TITLE_SIZE, FRAME_WIDTH),
+        TITLE_SIZE * 1.25,
+    )
+
+    if spec.get("instructions"):
+        flow.place_text(
+            {"kind": "instructions", "x": MARGIN, "width": FRAME_WIDTH, "font": BODY_FONT,
+             "size": INSTRUCTIONS_SIZE, "ascent": _ascent(BODY_FONT) * INSTRUCTIONS_SIZE},
+            wrap_text(spec["instructions"], BODY_FONT, INSTRUCTIONS_SIZE, FRAME_WIDTH),
+            INSTRUCTIONS_LEADING,
+        )
+
+    for index, element in enumerate(spec.get("elements", [])):
+        element_type = element.get("type")
+        position = element.get("position") or {}
+        # The LLM's x position is kept as an indent, within reason
+        x = _clamp(position.get("x"), MARGIN, MARGIN + FRAME_WIDTH / 2, MARGIN)
+        available = MARGIN + FRAME_WIDTH - x
+
+        if element_type == "text":
+            style = element.get("style") or {}
+            size = _clamp(style.get("fontSize"), 6, 48, 12)
+            font = BOLD_FONT if style.get("bold") else BODY_FONT
+            flow.place_text(
+                {"kind": "text", "x": x, "width": available, "font": font, "size": size,
+                 "bold": bool(style.get("bold")), "ascent": _ascent(font) * size,
+                 "element_index": index},
+                wrap_text(element.get("content", ""), font, size, available),
+                size * 1.25,
+            )
+
+        elif element_type == "image" and images_data:
+            size = element.get("size") or {}
+            width = _clamp(size.get("width"), 20, available, 200)
+            height = _clamp(size.get("height"), 20, FRAME_BOTTOM - MARGIN, 150)
+            description = element.get("description", "Image")
+            flow.place(
+                {"kind": "image", "x": x, "width": width, "description": description,
+                 "image_path": images_data.get(description), "element_index": index},
+                height,
+            )
+
+        elif element_type == "input_field":
+            size = element.get("size") or {}
+            width = _clamp(size.get("width"), 40, available, min(300, available))
+            height = _clamp(size.get("height"), 18, FRAME_BOTTOM - MARGIN, 30)
+            flow.place(
+                {"kind": "input_field", "x": x, "width": width,
+                 "placeholder": element.get("placeholder", ""), "element_index": index},
+                height,
+            )
+
+    return {"page_width": PAGE_WIDTH, "page_height": PAGE_HEIGHT, "pages": flow.pages}
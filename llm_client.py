@@ -1,29 +1,124 @@
 import json
 import os
+import time
 import logging
-from openai import OpenAI
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from clients import openai_client
+from cancellation import JobCancelled
+from metrics import CACHE_TOTAL
 
 # the newest OpenAI model is "gpt-4o" which was released May 13, 2024.
 # do not change this unless explicitly requested by the user
-OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY")
-openai_client = OpenAI(api_key=OPENAI_API_KEY)
+
+EMBEDDING_MODEL = "text-embedding-3-small"
+EMBEDDING_CACHE_SIZE = int(os.environ.get("EMBEDDING_CACHE_SIZE", "10000"))
+# Concurrent generate_embedding callers within this window share one API call
+EMBEDDING_BATCH_WINDOW = float(os.environ.get("EMBEDDING_BATCH_WINDOW", "0.02"))
+EMBEDDING_BATCH_MAX = int(os.environ.get("EMBEDDING_BATCH_MAX", "256"))
+
+_embedding_cache = OrderedDict()
+_embedding_cache_lock = threading.Lock()
+
+def _normalize_embedding_text(text):
+    return " ".join(str(text).split()).lower()
+
+def _cache_get(key):
+    with _embedding_cache_lock:
+        embedding = _embedding_cache.get(key)
+        if embedding is not None:
+            _embedding_cache.move_to_end(key)
+        return embedding
+
+def _cache_put(key, embedding):
+    with _embedding_cache_lock:
+        _embedding_cache[key] = embedding
+        _embedding_cache.move_to_end(key)
+        while len(_embedding_cache) > EMBEDDING_CACHE_SIZE:
+            _embedding_cache.popitem(last=False)
+
+def generate_embeddings(texts):
+    """Generate embeddings for a list of texts with a single API call.
+
+    Texts are normalized (case and whitespace) and memoized; only cache misses
+    are sent to OpenAI. Returns embeddings in input order.
+    """
+    keys = [_normalize_embedding_text(t) for t in texts]
+    results = {k: _cache_get(k) for k in keys}
+    missing = [k for k, v in results.items() if v is None]
+    CACHE_TOTAL.inc("embedding", "hit", amount=len(results) - len(missing))
+    CACHE_TOTAL.inc("embedding", "miss", amount=len(missing))
+    if missing:
+        try:
+            response = openai_client().embeddings.create(
+                model=EMBEDDING_MODEL,
+                input=missing
+            )
+        except Exception as e:
+            logging.error("Failed to generate embedding: %s", e)
+            raise
+        for item in response.data:
+            key = missing[item.index]
+            results[key] = item.embedding
+            _cache_put(key, item.embedding)
+    return [results[k] for k in keys]
+
+class _EmbeddingBatcher:
+    """Coalesces concurrent single-text requests into batched API calls."""
+
+    def __init__(self):
+        self._pending = []
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    def submit(self, text):
+        future = Future()
+        with self._lock:
+            self._pending.append((text, future))
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._run, name="embedding-batcher", daemon=True
+                )
+                self._thread.start()
+        self._wakeup.set()
+        return future
+
+    def _run(self):
+        while True:
+            self._wakeup.wait()
+            # Give other callers a moment to join this batch
+            time.sleep(EMBEDDING_BATCH_WINDOW)
+            with self._lock:
+                batch = self._pending[:EMBEDDING_BATCH_MAX]
+                self._pending = self._pending[EMBEDDING_BATCH_MAX:]
+                if not self._pending:
+                    self._wakeup.clear()
+            if batch:
+                self._flush(batch)
+
+    def _flush(self, batch):
+        try:
+            embeddings = generate_embeddings([text for text, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        for (_, future), embedding in zip(batch, embeddings):
+            future.set_result(embedding)
+
+_batcher = _EmbeddingBatcher()
 
 def generate_embedding(text):
-    """Generate embedding for text using OpenAI."""
-    try:
-        response = openai_client.embeddings.create(
-            model="text-embedding-3-small",
-            input=text
-        )
-        return response.data[0].embedding
-    except Exception as e:
-        logging.error(f"Failed to generate embedding: {e}")
-        raise
+    """Generate embedding for text using OpenAI (memoized and micro-batched)."""
+    cached = _cache_get(_normalize_embedding_text(text))
+    if cached is not None:
+        return cached
+    return _batcher.submit(text).result()
 
-def generate_worksheet_spec(prompt_data):
-    """Generate worksheet specification using OpenAI."""
-    try:
-        prompt = f"""Create a detailed educational worksheet specification in JSON format for:
+def _spec_prompt(prompt_data):
+    return f"""Create a detailed educational worksheet specification in JSON format for:
 - Grade Level: {prompt_data['gradeLevel']}
 - Topic: {prompt_data['topic']}
 - Activities: {prompt_data['activities']}
@@ -52,19 +147,129 @@ Return a JSON object with this exact structure:
 
 Keep layout within 612x792 points (letter size). Include 5-10 educational elements."""
 
-        response = openai_client.responses.create(
-            model="gpt-4.1",
-            input=prompt
-        )
-        
-        # Parse the JSON from the response
+class SpecStreamParser:
+    """Incremental parser for a streamed worksheet spec.
+
+    Feed it text deltas as they arrive; each call returns the items of the
+    top-level "elements" array that became complete, so callers can act on
+    them before the model has finished. finish() returns the whole spec.
+    """
+
+    def __init__(self):
+        self._buffer = ""
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._string_start = None
+        self._last_key = None
+        self._object_start = None
+        self._object_end = None
+        self._elements_depth = None
+        self._element_start = None
+        self.elements = []
+
+    def feed(self, delta):
+        self._buffer += delta
+        completed = []
+        buf = self._buffer
+        for i in range(self._pos, len(buf)):
+            ch = buf[i]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                    if self._depth == 1:
+                        self._last_key = buf[self._string_start + 1:i]
+                continue
+            if self._object_end is not None:
+                break
+            if ch == '"':
+                self._in_string = True
+                self._string_start = i
+            elif ch in "{[":
+                if self._depth == 0 and ch == "{":
+                    self._object_start = i
+                elif self._depth == 0:
+                    continue
+                if ch == "[" and self._depth == 1 and self._last_key == "elements":
+                    self._elements_depth = 2
+                if ch == "{" and self._depth == self._elements_depth:
+                    self._element_start = i
+                self._depth += 1
+            elif ch in "}]" and self._depth > 0:
+                self._depth -= 1
+                if ch == "}" and self._depth == self._elements_depth and self._element_start is not None:
+                    try:
+                        element = json.loads(buf[self._element_start:i + 1])
+                        self.elements.append(element)
+                        completed.append(element)
+                    except ValueError:
+                        pass  # finish() still parses the whole object
+                    self._element_start = None
+                elif ch == "]" and self._depth == 1:
+                    self._elements_depth = None
+                elif self._depth == 0:
+                    self._object_end = i + 1
+        self._pos = len(buf)
+        return completed
+
+    def finish(self):
+        """Parse and return the complete spec."""
+        if self._object_start is not None and self._object_end is not None:
+            try:
+                return json.loads(self._buffer[self._object_start:self._object_end])
+            except ValueError:
+                pass
+        # Fall back to the greedy match used before streaming
         import re
-        json_match = re.search(r'\{.*\}', response.output_text, re.DOTALL)
+        json_match = re.search(r'\{.*\}', self._buffer, re.DOTALL)
         if json_match:
             return json.loads(json_match.group())
-        else:
-            raise Exception("No valid JSON found in response")
+        raise Exception("No valid JSON found in response")
+
+def _check_stream_event(event):
+    if event.type in ("error", "response.failed"):
+        raise Exception(f"Spec generation failed: {getattr(event, 'message', None) or event.type}")
+
+def generate_worksheet_spec(prompt_data, on_element=None, cancel=None):
+    """Generate worksheet specification using OpenAI.
+
+    The response is streamed; on_element, if given, is called with each
+    element as soon as it has been fully received. Cancelling the optional
+    cancellation token closes the stream and raises JobCancelled.
+    """
+    try:
+        parser = SpecStreamParser()
+        stream = openai_client().responses.create(
+            model="gpt-4.1",
+            input=_spec_prompt(prompt_data),
+            stream=True
+        )
+        unregister = cancel.on_cancel(stream.close) if cancel else lambda: None
+        try:
+            for event in stream:
+                _check_stream_event(event)
+                if event.type == "response.output_text.delta":
+                    for element in parser.feed(event.delta):
+                        if on_element:
+                            on_element(element)
+        except Exception:
+            # Reading a stream closed by cancellation fails with a transport error
+            if cancel:
+                cancel.check()
+            raise
+        finally:
+            unregister()
+        if cancel:
+            cancel.check()
+        return parser.finish()
     
+    except JobCancelled:
+        raise
     except Exception as e:
-        logging.error(f"Failed to generate worksheet spec: {e}")
+        logging.error("Failed to generate worksheet spec: %s", e)
         raise
@@ -0,0 +1,201 @@
+import os
+import sys
+import json
+import queue
+import atexit
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+# Records are handed to a queue on the logging thread and formatted and
+# written by a single listener thread, so request and job threads never
+# block on stderr.
+#
+# APP_ENV picks the defaults: "development" logs everything as text,
+# "production" (the default unless FLASK_DEBUG=1) logs INFO and up as JSON
+# lines and samples high-frequency events.
+APP_ENV = os.environ.get("APP_ENV", "development" if os.environ.get("FLASK_DEBUG") == "1" else "production")
+_DEVELOPMENT = APP_ENV == "development"
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "DEBUG" if _DEVELOPMENT else "INFO").upper()
+# Per-logger levels, e.g. "sqlalchemy.engine=INFO,httpx=WARNING"
+LOG_LEVELS = os.environ.get("LOG_LEVELS", "" if _DEVELOPMENT else "httpx=WARNING,httpcore=WARNING,urllib3=WARNING")
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "text" if _DEVELOPMENT else "json")  # json|text
+# Events logged with extra={"sample": key} are kept 1 in LOG_SAMPLE_EVERY per
+# key (warnings and errors always); kept records carry "sampled": N
+LOG_SAMPLE_EVERY = int(os.environ.get("LOG_SAMPLE_EVERY", "1" if _DEVELOPMENT else "20"))
+
+# Fields added to every record logged in the current context (job_id, user_id)
+_context = contextvars.ContextVar("log_context", default={})
+
+# Attributes every LogRecord has; anything else was passed through extra=
+_RECORD_ATTRS = set(logging.makeLogRecord({}).__dict__) | {"message", "asctime", "context"}
+# Arguments that can't change between the call and the listener formatting it
+_IMMUTABLE = (str, int, float, bool, type(None), bytes)
+
+
+def bind(**fields):
+    """Add fields to the log context; returns a token for unbind()."""
+    return _context.set({**_context.get(), **fields})
+
+
+def unbind(token):
+    _context.reset(token)
+
+
+@contextmanager
+def log_context(**fields):
+    """Log records inside the block with these fields, e.g. job_id."""
+    token = bind(**fields)
+    try:
+        yield
+    finally:
+        unbind(token)
+
+
+class ContextFilter(logging.Filter):
+    """Captures the log context on the logging thread."""
+
+    def filter(self, record):
+        record.context = _context.get()
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """Keeps one of every `every` records of each sampled event."""
+
+    def __init__(self, every):
+        super().__init__()
+        self.every = every
+        self._counts = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        key = getattr(record, "sample", None)
+        if key is None or self.every <= 1 or record.levelno >= logging.WARNING:
+            return True
+        with self._lock:
+            count = self._counts.get(key, 0)
+            self._counts[key] = count + 1
+        if count % self.every:
+            return False
+        record.sampled = self.every
+        return True
+
+
+class LazyQueueHandler(QueueHandler):
+    """QueueHandler that leaves message formatting to the listener thread.
+
+    The stdlib handler renders every message before enqueueing it. Within
+    one process that is only needed for arguments that might be mutated
+    before the listener gets to them.
+    """
+
+    def prepare(self, record):
+        args = record.args
+        # A mapping (a lone dict argument becomes record.args) could change too
+        if args and (isinstance(args, dict) or not all(isinstance(a, _IMMUTABLE) for a in args)):
+            record.msg = record.getMessage()
+            record.args = None
+        return record
+
+
+def _extras(record):
+    return {k: v for k, v in record.__dict__.items() if k not in _RECORD_ATTRS}
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line."""
+
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "thread": record.threadName,
+        }
+        entry.update(getattr(record, "context", {}))
+        entry.update(_extras(record))
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        if record.stack_info:
+            entry["stack_info"] = self.formatStack(record.stack_info)
+        return json.dumps(entry, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """Plain text with the log context and extra fields appended."""
+
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    def format(self, record):
+        text = super().format(record)
+        fields = {**getattr(record, "context", {}), **_extras(record)}
+        if fields:
+            text += " [" + " ".join(f"{k}={v}" for k, v in fields.items()) + "]"
+        return text
+
+
+_listener = None
+_lock = threading.Lock()
+
+
+def configure(force=False):
+    """Route the root logger through the queue; later calls do nothing.
+
+    force=True starts a new listener, e.g. in a forked worker process that
+    inherited the handler but not the listener thread.
+    """
+    global _listener
+    with _lock:
+        if _listener is not None and not force:
+            return
+        first = _listener is None
+        stream = logging.StreamHandler(sys.stderr)
+        stream.setFormatter(JsonFormatter() if LOG_FORMAT == "json" else TextFormatter())
+        records = queue.SimpleQueue()
+        handler = LazyQueueHandler(records)
+        # Sampling first: dropped records cost nothing more
+        handler.addFilter(SamplingFilter(LOG_SAMPLE_EVERY))
+        handler.addFilter(ContextFilter())
+
+        root = logging.getLogger()
+        for existing in root.handlers[:]:
+            if isinstance(existing, QueueHandler):
+                root.removeHandler(existing)
+        root.addHandler(handler)
+        root.setLevel(LOG_LEVEL)
+        for item in filter(None, (part.strip() for part in LOG_LEVELS.split(","))):
+            name, _, level = item.partition("=")
+            logging.getLogger(name.strip()).setLevel(level.strip().upper())
+
+        _listener = QueueListener(records, stream, respect_handler_level=True)
+        _listener.start()
+        if first:
+            # Write out what is still queued at exit
+            atexit.register(lambda: _listener.stop())
+
+
+def init_app(app):
+    """Add the signed-in user's id to the log context of each request."""
+    from flask import g, session
+
+    @app.before_request
+    def _bind_user():
+        # From the session cookie rather than current_user, which would
+        # load the user for every request
+        user_id = session.get("_user_id")
+        g.log_token = bind(user_id=user_id) if user_id else None
+
+    @app.teardown_request
+    def _unbind_user(exc):
+        token = g.pop("log_token", None)
+        if token is not None:
+            try:
+                unbind(token)
+            except ValueError:
+                pass  # torn down from another context, e.g. a streamed response
@@ -0,0 +1,304 @@
+import os
+import glob
+import json
+import time
+import logging
+import threading
+from contextlib import contextmanager
+
+# Without a Prometheus client dependency: a small registry of counters,
+# gauges and histograms rendered in the Prometheus text format.
+#
+# Each process records its own metrics. With several processes (gunicorn
+# workers, WORKER_POOL_MODE=process) set METRICS_DIR to a directory shared by
+# them: every process writes a snapshot there every METRICS_FLUSH_INTERVAL
+# seconds and /metrics serves the sum over all processes.
+METRICS_DIR = os.environ.get("METRICS_DIR")
+METRICS_FLUSH_INTERVAL = float(os.environ.get("METRICS_FLUSH_INTERVAL", "5"))
+
+# Seconds; covers DB round trips up to multi-minute LLM calls
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}  # label values tuple -> value
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if len(labels) != len(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}")
+        return tuple(str(v) for v in labels)
+
+    def snapshot(self):
+        with self._lock:
+            return {json.dumps(k): v for k, v in self._values.items()}
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, *labels, amount=1):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name, documentation, labelnames=(), function=None):
+        super().__init__(name, documentation, labelnames)
+        self.function = function
+
+    def set(self, value, *labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, *labels, amount=1):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, *labels, amount=1):
+        self.inc(*labels, amount=-amount)
+
+    def snapshot(self):
+        if self.function is not None:
+            try:
+                self.set(self.function())
+            except Exception as e:
+                logging.debug("Gauge %s callback failed: %s", self.name, e)
+        return super().snapshot()
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labels):
+        key = self._key(labels)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = {"buckets": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry["buckets"][i] += 1
+            entry["sum"] += value
+            entry["count"] += 1
+
+    @contextmanager
+    def time(self, *labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *labels)
+
+    def snapshot(self):
+        with self._lock:
+            return {json.dumps(k): {"buckets": list(v["buckets"]), "sum": v["sum"], "count": v["count"]}
+                    for k, v in self._values.items()}
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+        self._flusher = None
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=(), function=None):
+        return self.register(Gauge(name, documentation, labelnames, function))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def snapshot(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return {m.name: m.snapshot() for m in metrics}
+
+    def reset(self):
+        """Forget recorded values, e.g. those a forked worker process
+        inherited from its parent."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        for metric in metrics:
+            with metric._lock:
+                metric._values.clear()
+
+    def _snapshot_path(self):
+        return os.path.join(METRICS_DIR, f"{os.getpid()}.json")
+
+    def write_snapshot(self):
+        os.makedirs(METRICS_DIR, exist_ok=True)
+        path = self._snapshot_path()
+        with open(path + ".tmp", "w") as f:
+            json.dump(self.snapshot(), f)
+        os.replace(path + ".tmp", path)
+
+    def start_flusher(self):
+        """Write this process's snapshot to METRICS_DIR periodically."""
+        if not METRICS_DIR:
+            return
+        with self._lock:
+            if self._flusher is not None and self._flusher.is_alive():
+                return
+            self._flusher = threading.Thread(target=self._flush_loop, name="metrics-flusher", daemon=True)
+            self._flusher.start()
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(METRICS_FLUSH_INTERVAL)
+            try:
+                self.write_snapshot()
+            except Exception as e:
+                logging.error("Failed to write metrics snapshot: %s", e)
+
+    def _collect(self):
+        """Snapshots of every live process (just this one without METRICS_DIR)."""
+        if not METRICS_DIR:
+            return [self.snapshot()]
+        self.write_snapshot()
+        snapshots = []
+        # Files of processes that stopped flushing are dropped (their
+        # counters reset, which Prometheus handles)
+        stale_before = time.time() - 3 * METRICS_FLUSH_INTERVAL
+        for path in glob.glob(os.path.join(METRICS_DIR, "*.json")):
+            try:
+                if os.path.getmtime(path) < stale_before:
+                    os.remove(path)
+                    continue
+                with open(path) as f:
+                    snapshots.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+        return snapshots
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format."""
+        snapshots = self._collect()
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            merged = {}
+            for snapshot in snapshots:
+                for key, value in snapshot.get(metric.name, {}).items():
+                    merged[key] = _merge(merged.get(key), value)
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for key, value in sorted(merged.items()):
+                labels = list(zip(metric.labelnames, json.loads(key)))
+                if metric.kind == "histogram":
+                    for bound, count in zip(metric.buckets, value["buckets"]):
+                        lines.append(_sample(f"{metric.name}_bucket", labels + [("le", _number(bound))], count))
+                    lines.append(_sample(f"{metric.name}_bucket", labels + [("le", "+Inf")], value["count"]))
+                    lines.append(_sample(f"{metric.name}_sum", labels, value["sum"]))
+                    lines.append(_sample(f"{metric.name}_count", labels, value["count"]))
+                else:
+                    lines.append(_sample(metric.name, labels, value))
+        return "\n".join(lines) + "\n"
+
+
+def _merge(a, b):
+    if a is None:
+        return b
+    if isinstance(a, dict):
+        return {"buckets": [x + y for x, y in zip(a["buckets"], b["buckets"])],
+                "sum": a["sum"] + b["sum"], "count": a["count"] + b["count"]}
+    return a + b
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _sample(name, labels, value):
+    if labels:
+        rendered = ",".join(f'{k}="{_escape(v)}"' for k, v in labels)
+        return f"{name}{{{rendered}}} {_number(value)}"
+    return f"{name} {_number(value)}"
+
+
+registry = Registry()
+
+# Pipeline metrics
+STAGE_SECONDS = registry.histogram(
+    "worksheet_stage_seconds", "Duration of worksheet pipeline stages.", ["stage"])
+QUEUE_WAIT_SECONDS = registry.histogram(
+    "worksheet_queue_wait_seconds", "Time jobs spent pending before a worker claimed them.")
+JOBS_TOTAL = registry.counter(
+    "worksheet_jobs_total", "Finished worksheet jobs by final status.", ["status"])
+JOBS_IN_FLIGHT = registry.gauge(
+    "worksheet_jobs_in_flight", "Worksheet jobs currently running.")
+SPEC_SOURCE_TOTAL = registry.counter(
+    "worksheet_spec_source_total", "Where job specs came from (checkpoint, spec_cache, semantic_cache, llm).", ["source"])
+CACHE_TOTAL = registry.counter(
+    "worksheet_cache_requests_total", "Cache lookups by cache and result (hit, miss, or the tier that hit).", ["cache", "result"])
+ERRORS_TOTAL = registry.counter(
+    "worksheet_errors_total", "Errors by kind (job, image, upload, embedding, ...).", ["kind"])
+DB_COMMIT_SECONDS = registry.histogram(
+    "worksheet_db_commit_seconds", "Duration of database commits.")
+HTTP_REQUEST_SECONDS = registry.histogram(
+    "http_request_seconds", "HTTP request latency by endpoint.", ["endpoint", "method", "status"])
+
+
+def observe_stage(stage, seconds):
+    STAGE_SECONDS.observe(seconds, stage)
+
+
+def instrument_app(app):
+    """Time every HTTP request and ORM session commit of a Flask app."""
+    from flask import request, g
+    from sqlalchemy import event
+    from sqlalchemy.orm import Session
+
+    @app.before_request
+    def _start_timer():
+        g.request_started = time.perf_counter()
+
+    @app.after_request
+    def _observe_request(response):
+        started = g.pop("request_started", None)
+        if started is not None:
+            HTTP_REQUEST_SECONDS.observe(time.perf_counter() - started,
+                                         request.endpoint or "unknown", request.method,
+                                         response.status_code)
+        return response
+
+    @event.listens_for(Session, "before_commit")
+    def _before_commit(session):
+        session.info["commit_started"] = time.perf_counter()
+
+    @event.listens_for(Session, "after_commit")
+    def _after_commit(session):
+        started = session.info.pop("commit_started", None)
+        if started is not None:
+            DB_COMMIT_SECONDS.observe(time.perf_counter() - started)
+
+    @event.listens_for(Session, "after_rollback")
+    def _after_rollback(session):
+        session.info.pop("commit_started", None)
@@ -0,0 +1,73 @@
+import logging
+from sqlalchemy import text
+
+# Idempotent schema changes for databases created before a column or index
+# existed. db.create_all() only creates missing tables, never alters them.
+MIGRATIONS = [
+    "ALTER TABLE worksheets ADD COLUMN IF NOT EXISTS spec_json JSON",
+    "ALTER TABLE worksheets ADD COLUMN IF NOT EXISTS checkpoint_json JSON",
+    "ALTER TABLE worksheets ADD COLUMN IF NOT EXISTS trace_json JSON",
+    "ALTER TABLE worksheets ADD COLUMN IF NOT EXISTS batch_id VARCHAR(36) "
+    "REFERENCES worksheet_batches(id)",
+    "CREATE INDEX IF NOT EXISTS ix_worksheets_batch_id ON worksheets (batch_id)",
+    "CREATE INDEX IF NOT EXISTS ix_worksheets_user_created "
+    "ON worksheets (user_id, created_at DESC, id DESC)",
+]
+
+# Serializes upgrades when several processes start at once
+MIGRATION_LOCK_ID = 4242001
+
+
+def _column_type(conn, table, column):
+    return conn.execute(
+        text(
+            "SELECT data_type FROM information_schema.columns "
+            "WHERE table_name = :table AND column_name = :column"
+        ),
+        {"table": table, "column": column},
+    ).scalar()
+
+
+def pack_embeddings(conn, batch_size=1000):
+    """Convert worksheets.embedding from double precision[] to packed bytea."""
+    from vector_type import pack_vector
+
+    if _column_type(conn, "worksheets", "embedding") != "ARRAY":
+        return 0
+    conn.execute(text("ALTER TABLE worksheets ADD COLUMN IF NOT EXISTS embedding_packed BYTEA"))
+    converted = 0
+    while True:
+        rows = conn.execute(
+            text(
+                "SELECT id, embedding FROM worksheets "
+                "WHERE embedding IS NOT NULL AND embedding_packed IS NULL LIMIT :limit"
+            ),
+            {"limit": batch_size},
+        ).all()
+        if not rows:
+            break
+        conn.execute(
+            text("UPDATE worksheets SET embedding_packed = :packed WHERE id = :id"),
+            [{"id": row.id, "packed": pack_vector(row.embedding)} for row in rows],
+        )
+        converted += len(rows)
+    conn.execute(text("ALTER TABLE worksheets DROP COLUMN embedding"))
+    conn.execute(text("ALTER TABLE worksheets RENAME COLUMN embedding_packed TO embedding"))
+    logging.info("Packed %s worksheet embeddings into bytea", converted)
+    return converted
+
+
+# Migrations that need Python to rewrite existing rows
+DATA_MIGRATIONS = [pack_embeddings]
+
+
+def upgrade(db):
+    """Apply every migration. Run by the `flask migrate` command once per
+    deploy; safe to repeat, and concurrent runs wait on an advisory lock."""
+    with db.engine.begin() as conn:
+        conn.execute(text("SELECT pg_advisory_xact_lock(:id)"), {"id": MIGRATION_LOCK_ID})
+        for statement in MIGRATIONS:
+            conn.execute(text(statement))
+        for migration in DATA_MIGRATIONS:
+            migration(conn)
+    logging.info("Applied %s schema migrations", len(MIGRATIONS) + len(DATA_MIGRATIONS))
@@ -2,8 +2,10 @@ import uuid
 from datetime import datetime
 from app import db
 from flask_login import UserMixin
-from sqlalchemy.dialects.postgresql import UUID, ARRAY
+from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy import func
+from sqlalchemy.orm import deferred
+from vector_type import PackedVector
 
 class User(UserMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -32,8 +34,24 @@ class Worksheet(db.Model):
     pdf_path = db.Column(db.String(255), nullable=True)
     interactive_path = db.Column(db.String(255), nullable=True)
     error_message = db.Column(db.Text, nullable=True)
-    # Store embedding as array of floats - pgvector integration would require additional setup
-    embedding = db.Column(ARRAY(db.Float), nullable=True)
+    # Generated worksheet specification, reused by the semantic spec cache.
+    # Large columns are deferred: loaded only when accessed.
+    spec_json = deferred(db.Column(db.JSON, nullable=True))
+    # Outputs of completed pipeline stages after the spec, e.g. {"images":
+    # {description: path}}, so a retried job resumes where it stopped
+    checkpoint_json = deferred(db.Column(db.JSON, nullable=True))
+    # Per-stage timings of the last run, if JOB_TRACE_ENABLED
+    trace_json = deferred(db.Column(db.JSON, nullable=True))
+    # Set for worksheets created through the batch API
+    batch_id = db.Column(db.String(36), db.ForeignKey('worksheet_batches.id'), nullable=True, index=True)
+    # Topic embedding packed into bytea (see vector_type.py); read back as a
+    # NumPy float32 array
+    embedding = deferred(db.Column(PackedVector(), nullable=True))
+    
+    # Serves the per-user listing, newest first (keyset pagination)
+    __table_args__ = (
+        db.Index("ix_worksheets_user_created", "user_id", created_at.desc(), id.desc()),
+    )
     
     def __init__(self, id=None, user_id=None, prompt_json=None, embedding=None, status="pending"):
         self.id = id
@@ -41,3 +59,53 @@ class Worksheet(db.Model):
         self.prompt_json = prompt_json
         self.embedding = embedding
         self.status = status
+    
+    def status_dict(self):
+        """Status payload shared by the status endpoint and the event stream."""
+        return status_payload({
+            "status": self.status,
+            "progress_step": self.progress_step,
+            "progress_percent": self.progress_percent,
+            "created_at": self.created_at,
+            "pdf_path": self.pdf_path,
+            "interactive_path": self.interactive_path,
+            "error_message": self.error_message,
+        })
+
+def status_payload(fields):
+    """Build the public status payload from a dict of worksheet fields."""
+    response = {
+        "status": fields["status"],
+        "progress_step": fields["progress_step"],
+        "progress_percent": fields["progress_percent"],
+        "created_at": fields["created_at"].isoformat()
+    }
+    
+    if fields["status"] == "done":
+        response["pdf_path"] = fields["pdf_path"]
+        response["interactive_path"] = fields["interactive_path"]
+    elif fields["status"] == "error":
+        response["error_message"] = fields["error_message"]
+    
+    return response
+
+class WorksheetBatch(db.Model):
+    """A group of worksheets created together (see batches.py)."""
+    __tablename__ = "worksheet_batches"
+    
+    id = db.Column(db.String(36), primary_key=True)  # UUID as string
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    created_at = db.Column(db.DateTime(timezone=True), server_default=func.now(), nullable=False)
+    combine_pdf = db.Column(db.Boolean, nullable=False, default=False)
+    status = db.Column(db.String(20), nullable=False, default="in_progress")  # in_progress|combining|done|error
+    combined_pdf_path = db.Column(db.String(255), nullable=True)
+    error_message = db.Column(db.Text, nullable=True)
+
+class SpecCacheEntry(db.Model):
+    """Persistent tier of the exact-match spec cache (see spec_cache.py)."""
+    __tablename__ = "spec_cache"
+    
+    key = db.Column(db.String(64), primary_key=True)  # sha256 of the canonical prompt
+    spec_json = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime(timezone=True), server_default=func.now(), nullable=False)
+    last_used_at = db.Column(db.DateTime(timezone=True), server_default=func.now(), nullable=False, index=True)
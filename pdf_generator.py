@@ -1,18 +1,43 @@
 import os
 import logging
-from reportlab.lib.pagesizes import letter
-from reportlab.pdfgen import canvas
-from reportlab.lib.units import inch
-from reportlab.pdfbase import pdfmetrics
-from reportlab.pdfbase.ttfonts import TTFont
-from reportlab.lib.styles import getSampleStyleSheet
-from reportlab.platypus import Paragraph
-from reportlab.lib.colors import black
-from PIL import Image
-import io
+from layout import layout_spec, PLACEHOLDER_FONT, PLACEHOLDER_SIZE
 
-def create_pdf_from_spec(spec, job_id, images_data=None):
-    """Create a PDF worksheet from specification."""
+def _draw_layout(c, layout):
+    """Draw every page of a layout onto the canvas, ending on its last page."""
+    height = layout["page_height"]
+    for page_number, boxes in enumerate(layout["pages"]):
+        if page_number:
+            c.showPage()
+        for box in boxes:
+            # Layout boxes are top-left based; PDF coordinates grow upwards
+            top = height - box["y"]
+            
+            if box["kind"] in ("title", "instructions", "text"):
+                c.setFont(box["font"], box["size"])
+                for i, line in enumerate(box["lines"]):
+                    c.drawString(box["x"], top - box["ascent"] - i * box["leading"], line)
+            
+            elif box["kind"] == "image":
+                c.rect(box["x"], top - box["height"], box["width"], box["height"])
+                c.setFont(PLACEHOLDER_FONT, PLACEHOLDER_SIZE)
+                c.drawString(box["x"] + 5, top - 15, f"[Image: {box['description']}]")
+            
+            elif box["kind"] == "input_field":
+                # Draw input field as rectangle
+                c.rect(box["x"], top - box["height"], box["width"], box["height"])
+                if box["placeholder"]:
+                    c.setFont(PLACEHOLDER_FONT, PLACEHOLDER_SIZE)
+                    c.drawString(box["x"] + 5, top - box["height"] + 5, box["placeholder"])
+
+def create_pdf_from_spec(spec, job_id, images_data=None, layout=None):
+    """Create a PDF worksheet from specification.
+
+    layout is the result of layout.layout_spec; it is computed here if the
+    caller has not already done so.
+    """
+    # ReportLab is imported on first use, keeping it out of app startup
+    from reportlab.pdfgen import canvas
+    
     try:
         # Create directory for this job
         job_dir = f"worksheets/{job_id}"
@@ -20,72 +45,41 @@ def create_pdf_from_spec(spec, job_id, images_data=None):
         
         pdf_path = f"{job_dir}/worksheet.pdf"
         
-        # Create PDF
-        c = canvas.Canvas(pdf_path, pagesize=letter)
-        width, height = letter
-        
-        # Add title
-        c.setFont("Helvetica-Bold", 16)
-        title = spec.get("title", "Worksheet")
-        c.drawString(50, height - 50, title)
-        
-        # Add instructions
-        if spec.get("instructions"):
-            c.setFont("Helvetica", 10)
-            instructions = spec["instructions"]
-            # Simple text wrapping
-            lines = []
-            words = instructions.split()
-            line = ""
-            for word in words:
-                if len(line + word) < 80:  # Simple character limit
-                    line += word + " "
-                else:
-                    lines.append(line.strip())
-                    line = word + " "
-            if line:
-                lines.append(line.strip())
-            
-            y_pos = height - 80
-            for line in lines:
-                c.drawString(50, y_pos, line)
-                y_pos -= 15
+        if layout is None:
+            layout = layout_spec(spec, images_data)
         
-        # Process elements
-        for element in spec.get("elements", []):
-            element_type = element.get("type")
-            position = element.get("position", {"x": 50, "y": 300})
-            x, y = position["x"], height - position["y"]  # Convert to PDF coordinates
-            
-            if element_type == "text":
-                content = element.get("content", "")
-                style = element.get("style", {})
-                font_size = style.get("fontSize", 12)
-                is_bold = style.get("bold", False)
-                
-                font_name = "Helvetica-Bold" if is_bold else "Helvetica"
-                c.setFont(font_name, font_size)
-                c.drawString(x, y, content)
-                
-            elif element_type == "image" and images_data:
-                size = element.get("size", {"width": 200, "height": 150})
-                # Add placeholder for image
-                c.rect(x, y - size["height"], size["width"], size["height"])
-                c.drawString(x + 5, y - 10, f"[Image: {element.get('description', 'Image')}]")
-                
-            elif element_type == "input_field":
-                size = element.get("size", {"width": 300, "height": 30})
-                placeholder = element.get("placeholder", "")
-                
-                # Draw input field as rectangle
-                c.rect(x, y - size["height"], size["width"], size["height"])
-                if placeholder:
-                    c.setFont("Helvetica", 10)
-                    c.drawString(x + 5, y - size["height"] + 5, placeholder)
+        # Create PDF
+        c = canvas.Canvas(pdf_path, pagesize=(layout["page_width"], layout["page_height"]))
+        _draw_layout(c, layout)
+        c.save()
+        return pdf_path
         
+    except Exception as e:
+        logging.error("Failed to create PDF: %s", e)
+        raise
+
+def create_combined_pdf(worksheets, pdf_path):
+    """Create one PDF of several worksheets, each starting on a new page.
+
+    worksheets is a list of (spec, images_data) pairs.
+    """
+    from reportlab.pdfgen import canvas
+    
+    try:
+        os.makedirs(os.path.dirname(pdf_path), exist_ok=True)
+        c = None
+        for spec, images_data in worksheets:
+            layout = layout_spec(spec, images_data)
+            if c is None:
+                c = canvas.Canvas(pdf_path, pagesize=(layout["page_width"], layout["page_height"]))
+            else:
+                c.showPage()
+            _draw_layout(c, layout)
+        if c is None:
+            raise ValueError("No worksheets to combine")
         c.save()
         return pdf_path
         
     except Exception as e:
-        logging.error(f"Failed to create PDF: {e}")
+        logging.error("Failed to create combined PDF: %s", e)
         raise
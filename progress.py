@@ -0,0 +1,172 @@
+import os
+import time
+import logging
+import threading
+
+from metrics import STAGE_SECONDS
+
+# Progress-only changes are written to the database at most this often
+# (seconds); status transitions are written immediately.
+PROGRESS_FLUSH_INTERVAL = float(os.environ.get("PROGRESS_FLUSH_INTERVAL", "1.0"))
+
+PROGRESS_FIELDS = ("status", "progress_step", "progress_percent",
+                   "pdf_path", "interactive_path", "error_message")
+
+
+class ProgressReporter:
+    """In-memory progress of the jobs running in this process.
+
+    Updates are visible at once through get() and pushed to event stream
+    subscribers. Persistence is coalesced: a background thread writes every
+    changed job in one UPDATE ... FROM (VALUES ...) per interval, and a status
+    change flushes synchronously so transitions are never lost or reordered.
+    """
+
+    def __init__(self, interval=PROGRESS_FLUSH_INTERVAL):
+        self.interval = interval
+        self._jobs = {}  # job_id -> worksheet fields
+        self._versions = {}  # job_id -> version of the last change
+        self._dirty = set()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._flusher = None
+
+    def start(self, worksheet):
+        """Track a job, seeded with the current fields of its worksheet row."""
+        fields = {name: getattr(worksheet, name) for name in PROGRESS_FIELDS}
+        fields["created_at"] = worksheet.created_at
+        with self._lock:
+            self._jobs[worksheet.id] = fields
+            self._versions[worksheet.id] = 0
+        self._ensure_flusher()
+
+    def get(self, job_id):
+        """Latest status payload of a job running in this process, or None."""
+        from models import status_payload
+
+        with self._lock:
+            fields = self._jobs.get(job_id)
+            return status_payload(fields) if fields else None
+
+    def update(self, job_id, **fields):
+        """Record new progress fields of a job, e.g. progress_percent=40."""
+        from events import broker
+        from models import status_payload
+
+        with self._lock:
+            current = self._jobs.get(job_id)
+            if current is None:
+                logging.warning("Progress update for untracked job %s", job_id)
+                return
+            transition = "status" in fields and fields["status"] != current["status"]
+            current.update(fields)
+            self._versions[job_id] += 1
+            self._dirty.add(job_id)
+            payload = status_payload(current)
+        if broker.backend == "memory":
+            broker.publish(job_id, payload)
+        if transition:
+            self.flush()
+
+    def finish(self, job_id):
+        """Persist whatever is pending for a job and stop tracking it."""
+        self.flush()
+        with self._lock:
+            self._jobs.pop(job_id, None)
+            self._versions.pop(job_id, None)
+            self._dirty.discard(job_id)
+
+    def flush(self):
+        """Write every changed job to the database in a single statement."""
+        with self._flush_lock:
+            with self._lock:
+                batch = {job_id: (dict(self._jobs[job_id]), self._versions[job_id])
+                         for job_id in self._dirty}
+            if not batch:
+                return 0
+            try:
+                with STAGE_SECONDS.time("progress_flush"):
+                    written = self._write({job_id: fields for job_id, (fields, _) in batch.items()})
+            except Exception as e:
+                # Left dirty; the next flush retries
+                logging.error("Failed to persist progress of %s job(s): %s", len(batch), e)
+                return 0
+            with self._lock:
+                for job_id, (fields, version) in batch.items():
+                    if self._versions.get(job_id) != version:
+                        continue  # changed during the write, still dirty
+                    self._dirty.discard(job_id)
+                    if fields["status"] != "in_progress":
+                        # Persisted final state; the database is authoritative now
+                        self._jobs.pop(job_id, None)
+                        self._versions.pop(job_id, None)
+        self._publish_persisted({job_id: batch[job_id] for job_id in written})
+        return len(batch)
+
+    def _write(self, batch):
+        """Persist the fields of each job; returns the ids of the rows updated."""
+        from sqlalchemy import text
+        from app import app, db
+
+        values, params = [], {}
+        for n, (job_id, fields) in enumerate(batch.items()):
+            values.append(f"(:id{n}, :status{n}, :step{n}, :percent{n}, "
+                          f":pdf{n}, :html{n}, :error{n})")
+            params.update({
+                f"id{n}": job_id,
+                f"status{n}": fields["status"],
+                f"step{n}": fields.get("progress_step"),
+                f"percent{n}": fields.get("progress_percent"),
+                f"pdf{n}": fields.get("pdf_path"),
+                f"html{n}": fields.get("interactive_path"),
+                f"error{n}": fields.get("error_message"),
+            })
+        # A job cancelled by its owner keeps that status
+        statement = text(
+            "UPDATE worksheets AS w SET "
+            "status = v.status, "
+            "progress_step = v.progress_step, "
+            "progress_percent = CAST(v.progress_percent AS integer), "
+            "pdf_path = COALESCE(v.pdf_path, w.pdf_path), "
+            "interactive_path = COALESCE(v.interactive_path, w.interactive_path), "
+            "error_message = COALESCE(v.error_message, w.error_message), "
+            "updated_at = now() "
+            "FROM (VALUES " + ", ".join(values) + ") "
+            "AS v(id, status, progress_step, progress_percent, pdf_path, interactive_path, error_message) "
+            "WHERE w.id = v.id AND w.status <> 'cancelled' "
+            "RETURNING w.id"
+        )
+        with app.app_context():
+            with db.engine.begin() as conn:
+                return {row.id for row in conn.execute(statement, params)}
+
+    def _publish_persisted(self, batch):
+        # Other processes only see what reached the database; a cancelled
+        # job's row was left alone, so its progress is not published either
+        from events import broker
+        from models import status_payload
+
+        if broker.backend == "memory":
+            return
+        for job_id, (fields, _) in batch.items():
+            broker.publish(job_id, status_payload(fields))
+
+    def _ensure_flusher(self):
+        with self._lock:
+            if self._flusher is None or not self._flusher.is_alive():
+                self._flusher = threading.Thread(
+                    target=self._flush_loop, name="progress-flusher", daemon=True
+                )
+                self._flusher.start()
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.flush()
+            except Exception as e:
+                logging.error("Progress flush failed: %s", e)
+
+
+progress = ProgressReporter()
+
@@ -0,0 +1,71 @@
+import os
+import copy
+import logging
+
+# Reuse the spec of an earlier worksheet when the topic embeddings are at
+# least this similar (cosine) and every other prompt field matches.
+SEMANTIC_CACHE_ENABLED = os.environ.get("SEMANTIC_CACHE_ENABLED", "1") == "1"
+SEMANTIC_CACHE_THRESHOLD = float(os.environ.get("SEMANTIC_CACHE_THRESHOLD", "0.95"))
+# Number of nearest neighbours fetched from the embedding index
+SEMANTIC_CACHE_CANDIDATES = int(os.environ.get("SEMANTIC_CACHE_CANDIDATES", "20"))
+
+MATCH_FIELDS = ("gradeLevel", "activities", "style", "imagesAllowed")
+
+
+def normalize_text(value):
+    """Lowercase and collapse whitespace so cosmetic differences don't matter."""
+    return " ".join(str(value).split()).lower()
+
+
+def canonical_prompt(prompt_data):
+    """Return the prompt fields that define a worksheet, normalized."""
+    return {
+        "gradeLevel": normalize_text(prompt_data.get("gradeLevel", "")),
+        "topic": normalize_text(prompt_data.get("topic", "")),
+        "activities": normalize_text(prompt_data.get("activities", "")),
+        "style": normalize_text(prompt_data.get("style", "")),
+        "imagesAllowed": bool(prompt_data.get("imagesAllowed", False)),
+    }
+
+
+def find_similar_spec(prompt_data, embedding, exclude_id=None):
+    """Return (worksheet_id, spec) of the closest finished worksheet, or None."""
+    if not SEMANTIC_CACHE_ENABLED or embedding is None or len(embedding) == 0:
+        return None
+
+    from models import Worksheet
+    from embedding_index import get_index
+
+    wanted = canonical_prompt(prompt_data)
+    best = None
+    try:
+        scores = {
+            item_id: score
+            for item_id, score in get_index().search(embedding, k=SEMANTIC_CACHE_CANDIDATES)
+            if score >= SEMANTIC_CACHE_THRESHOLD and item_id != exclude_id
+        }
+        if not scores:
+            return None
+        candidates = (
+            Worksheet.query
+            .filter(Worksheet.id.in_(scores))
+            .filter(Worksheet.status == "done")
+            .filter(Worksheet.spec_json.isnot(None))
+        )
+        for candidate in candidates:
+            fields = canonical_prompt(candidate.prompt_json)
+            if any(fields[f] != wanted[f] for f in MATCH_FIELDS):
+                continue
+            score = scores[candidate.id]
+            if best is None or score > best[0]:
+                best = (score, candidate)
+    except Exception as e:
+        # A cache lookup failure must never fail the job; fall back to the LLM
+        logging.error("Semantic cache lookup failed: %s", e)
+        return None
+
+    if best is None:
+        return None
+    score, match = best
+    logging.info("Semantic cache hit: reusing spec of %s (similarity %.3f)", match.id, score)
+    return match.id, copy.deepcopy(match.spec_json)
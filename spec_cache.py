@@ -0,0 +1,158 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+from semantic_cache import canonical_prompt
+from metrics import CACHE_TOTAL
+
+# Exact-match cache of generated specs, keyed by a hash of the normalized prompt
+SPEC_CACHE_ENABLED = os.environ.get("SPEC_CACHE_ENABLED", "1") == "1"
+SPEC_CACHE_TTL = int(os.environ.get("SPEC_CACHE_TTL", str(7 * 24 * 3600)))
+SPEC_CACHE_MEMORY_ENTRIES = int(os.environ.get("SPEC_CACHE_MEMORY_ENTRIES", "1000"))
+SPEC_CACHE_MAX_ROWS = int(os.environ.get("SPEC_CACHE_MAX_ROWS", "100000"))
+# Persistent-tier eviction runs once every this many writes
+SPEC_CACHE_EVICT_EVERY = 100
+
+
+def prompt_key(prompt_data):
+    """Content address of a prompt: sha256 of its canonical JSON."""
+    canonical = json.dumps(canonical_prompt(prompt_data), sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class SpecCache:
+    """Two-tier spec cache: an in-process LRU in front of the spec_cache table.
+
+    Specs are held as JSON strings so every get returns an independent copy.
+    """
+
+    def __init__(self, memory_entries=SPEC_CACHE_MEMORY_ENTRIES, ttl=SPEC_CACHE_TTL,
+                 max_rows=SPEC_CACHE_MAX_ROWS):
+        self.memory_entries = memory_entries
+        self.ttl = ttl
+        self.max_rows = max_rows
+        self._memory = OrderedDict()  # key -> (expires_at, spec_text)
+        self._lock = threading.Lock()
+        self._writes = 0
+        self.stats = {"memory_hits": 0, "db_hits": 0, "misses": 0, "writes": 0}
+
+    def get(self, prompt_data):
+        """Return a cached spec for this prompt, or None."""
+        key = prompt_key(prompt_data)
+        spec_text = self._memory_get(key)
+        if spec_text is not None:
+            self._count("memory_hits")
+            return json.loads(spec_text)
+
+        try:
+            spec_text = self._db_get(key)
+        except Exception as e:
+            logging.error("Spec cache lookup failed: %s", e)
+            spec_text = None
+        if spec_text is None:
+            self._count("misses")
+            return None
+        self._count("db_hits")
+        self._memory_put(key, spec_text)
+        return json.loads(spec_text)
+
+    def put(self, prompt_data, spec):
+        """Store a freshly generated spec in both tiers."""
+        key = prompt_key(prompt_data)
+        spec_text = json.dumps(spec)
+        self._memory_put(key, spec_text)
+        self._count("writes")
+        try:
+            self._db_put(key, spec_text)
+        except Exception as e:
+            logging.error("Failed to persist spec cache entry: %s", e)
+
+    def _count(self, name):
+        with self._lock:
+            self.stats[name] += 1
+        result = {"memory_hits": "memory_hit", "db_hits": "db_hit", "misses": "miss"}.get(name)
+        if result:
+            CACHE_TOTAL.inc("spec", result)
+
+    def _memory_get(self, key):
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is None:
+                return None
+            expires_at, spec_text = entry
+            if expires_at < time.monotonic():
+                del self._memory[key]
+                return None
+            self._memory.move_to_end(key)
+            return spec_text
+
+    def _memory_put(self, key, spec_text):
+        with self._lock:
+            self._memory[key] = (time.monotonic() + self.ttl, spec_text)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_entries:
+                self._memory.popitem(last=False)
+
+    def _db_get(self, key):
+        from sqlalchemy import update, func, text
+        from app import db
+        from models import SpecCacheEntry
+
+        table = SpecCacheEntry.__table__
+        with db.engine.begin() as conn:
+            row = conn.execute(
+                update(table)
+                .where(table.c.key == key)
+                .where(table.c.last_used_at > func.now() - text(f"interval '{int(self.ttl)} seconds'"))
+                .values(last_used_at=func.now())
+                .returning(table.c.spec_json)
+            ).first()
+        return row.spec_json if row else None
+
+    def _db_put(self, key, spec_text):
+        from sqlalchemy import func
+        from sqlalchemy.dialects.postgresql import insert
+        from app import db
+        from models import SpecCacheEntry
+
+        table = SpecCacheEntry.__table__
+        stmt = insert(table).values(key=key, spec_json=spec_text)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.c.key],
+            set_={"spec_json": stmt.excluded.spec_json, "last_used_at": func.now()},
+        )
+        with db.engine.begin() as conn:
+            conn.execute(stmt)
+
+        with self._lock:
+            self._writes += 1
+            evict = self._writes % SPEC_CACHE_EVICT_EVERY == 0
+        if evict:
+            self.evict()
+
+    def evict(self):
+        """Drop expired rows and the least recently used rows beyond max_rows."""
+        from sqlalchemy import text
+        from app import db
+
+        with db.engine.begin() as conn:
+            expired = conn.execute(
+                text("DELETE FROM spec_cache WHERE last_used_at < now() - make_interval(secs => :ttl)"),
+                {"ttl": self.ttl},
+            ).rowcount
+            overflow = conn.execute(
+                text(
+                    "DELETE FROM spec_cache WHERE key IN ("
+                    "SELECT key FROM spec_cache ORDER BY last_used_at DESC OFFSET :max_rows)"
+                ),
+                {"max_rows": self.max_rows},
+            ).rowcount
+        if expired or overflow:
+            logging.info("Spec cache evicted %s expired and %s overflow rows", expired, overflow)
+
+
+spec_cache = SpecCache()
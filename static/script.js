@@ -2,6 +2,10 @@
 
 let currentJobId = null;
 let pollingInterval = null;
+let eventSource = null;
+let eventStreamOpened = false;
+let eventSourceFailed = false;
+let worksheetsCursor = null;  // X-Next-Cursor of the last page shown
 
 // Initialize the application
 document.addEventListener('DOMContentLoaded', function() {
@@ -82,6 +86,12 @@ function hideGenerationStatus() {
 function startPolling() {
     if (!currentJobId) return;
     
+    // Prefer pushed updates; fall back to polling if the stream is unavailable
+    if (window.EventSource && !eventSourceFailed) {
+        startEventStream();
+        return;
+    }
+    
     pollingInterval = setInterval(async () => {
         try {
             const response = await fetch(`/api/worksheet/${currentJobId}/status`);
@@ -91,20 +101,7 @@ function startPolling() {
             }
             
             const status = await response.json();
-            updateStatusDisplay(status);
-            
-            if (status.status === 'done') {
-                stopPolling();
-                showResults(status);
-                loadMyWorksheets(); // Refresh the list
-            } else if (status.status === 'error') {
-                stopPolling();
-                showError(status.error_message);
-            } else if (status.status === 'cancelled') {
-                stopPolling();
-                showAlert('Worksheet generation was cancelled.', 'warning');
-                hideGenerationStatus();
-            }
+            handleStatusUpdate(status);
             
         } catch (error) {
             console.error('Error polling status:', error);
@@ -114,11 +111,53 @@ function startPolling() {
     }, 2000); // Poll every 2 seconds
 }
 
+function startEventStream() {
+    eventSource = new EventSource(`/api/worksheet/${currentJobId}/events`);
+    
+    eventSource.onmessage = function(event) {
+        eventStreamOpened = true;
+        handleStatusUpdate(JSON.parse(event.data));
+    };
+    
+    eventSource.onerror = function() {
+        // Reconnects after a server-side stream timeout are handled by the
+        // browser; only fall back to polling if the stream never worked.
+        if (!eventStreamOpened || eventSource.readyState === EventSource.CLOSED) {
+            console.warn('Event stream unavailable, falling back to polling');
+            stopPolling();
+            eventSourceFailed = true;
+            startPolling();
+        }
+    };
+}
+
+function handleStatusUpdate(status) {
+    updateStatusDisplay(status);
+    
+    if (status.status === 'done') {
+        stopPolling();
+        showResults(status);
+        loadMyWorksheets(); // Refresh the list
+    } else if (status.status === 'error') {
+        stopPolling();
+        showError(status.error_message);
+    } else if (status.status === 'cancelled') {
+        stopPolling();
+        showAlert('Worksheet generation was cancelled.', 'warning');
+        hideGenerationStatus();
+    }
+}
+
 function stopPolling() {
     if (pollingInterval) {
         clearInterval(pollingInterval);
         pollingInterval = null;
     }
+    if (eventSource) {
+        eventSource.close();
+        eventSource = null;
+    }
+    eventStreamOpened = false;
 }
 
 function updateStatusDisplay(status) {
@@ -217,13 +256,8 @@ async function loadMyWorksheets() {
     const container = document.getElementById('worksheetsList');
     
     try {
-        const response = await fetch('/api/worksheets');
-        
-        if (!response.ok) {
-            throw new Error('Failed to load worksheets');
-        }
-        
-        const worksheets = await response.json();
+        // Only the first page; older ones are fetched by "Load more"
+        const worksheets = await fetchWorksheetsPage(null);
         
         if (worksheets.length === 0) {
             container.innerHTML = `
@@ -236,7 +270,8 @@ async function loadMyWorksheets() {
             return;
         }
         
-        container.innerHTML = worksheets.map(ws => createWorksheetItem(ws)).join('');
+        container.innerHTML = worksheets.map(ws => createWorksheetItem(ws)).join('')
+            + loadMoreButton();
         
     } catch (error) {
         console.error('Error loading worksheets:', error);
@@ -249,6 +284,48 @@ async function loadMyWorksheets() {
     }
 }
 
+async function loadMoreWorksheets() {
+    const button = document.getElementById('loadMoreWorksheets');
+    if (!button || !worksheetsCursor) {
+        return;
+    }
+    button.disabled = true;
+    
+    try {
+        const worksheets = await fetchWorksheetsPage(worksheetsCursor);
+        button.parentElement.outerHTML = worksheets.map(ws => createWorksheetItem(ws)).join('')
+            + loadMoreButton();
+    } catch (error) {
+        console.error('Error loading more worksheets:', error);
+        button.disabled = false;
+    }
+}
+
+async function fetchWorksheetsPage(cursor) {
+    const url = cursor ? `/api/worksheets?cursor=${encodeURIComponent(cursor)}` : '/api/worksheets';
+    const response = await fetch(url);
+    
+    if (!response.ok) {
+        throw new Error('Failed to load worksheets');
+    }
+    
+    worksheetsCursor = response.headers.get('X-Next-Cursor');
+    return response.json();
+}
+
+function loadMoreButton() {
+    if (!worksheetsCursor) {
+        return '';
+    }
+    return `
+        <div class="text-center pt-3">
+            <button id="loadMoreWorksheets" class="btn btn-sm btn-outline-secondary" onclick="loadMoreWorksheets()">
+                <i class="fas fa-chevron-down me-1"></i> Load more
+            </button>
+        </div>
+    `;
+}
+
 function createWorksheetItem(worksheet) {
     const createdDate = new Date(worksheet.created_at).toLocaleDateString();
     const statusClass = `status-${worksheet.status}`;
@@ -266,8 +343,16 @@ function createWorksheetItem(worksheet) {
                 </button>
             </div>
         `;
-    } else if (worksheet.status === 'error') {
-        actions = `<span class="text-danger"><i class="fas fa-times me-1"></i> Failed</span>`;
+    } else if (worksheet.status === 'error' || worksheet.status === 'cancelled') {
+        const label = worksheet.status === 'error'
+            ? `<span class="text-danger me-2"><i class="fas fa-times me-1"></i> Failed</span>`
+            : `<span class="text-muted me-2"><i class="fas fa-ban me-1"></i> Cancelled</span>`;
+        actions = `
+            ${label}
+            <button class="btn btn-sm btn-outline-primary" onclick="retryWorksheet('${worksheet.id}')">
+                <i class="fas fa-redo me-1"></i> Retry
+            </button>
+        `;
     } else {
         actions = `<span class="text-warning"><i class="fas fa-clock me-1"></i> Processing</span>`;
     }
@@ -343,7 +428,7 @@ function escapeHtml(text) {
 
 // Handle page visibility changes to pause/resume polling
 document.addEventListener('visibilitychange', function() {
-    if (document.hidden && pollingInterval) {
+    if (document.hidden && (pollingInterval || eventSource)) {
         stopPolling();
     } else if (!document.hidden && currentJobId) {
         startPolling();
@@ -385,3 +470,29 @@ async function cancelWorksheet() {
         showAlert('Error cancelling generation. Please try again.', 'danger');
     }
 }
+
+// Retry a failed or cancelled worksheet; finished stages are not redone
+async function retryWorksheet(jobId) {
+    try {
+        const response = await fetch(`/api/worksheet/${jobId}/retry`, {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json'
+            }
+        });
+        
+        if (!response.ok) {
+            const error = await response.json();
+            throw new Error(error.message || error.error || 'Failed to retry worksheet');
+        }
+        
+        stopPolling();
+        showGenerationStatus();
+        currentJobId = jobId;
+        startPolling();
+        
+    } catch (error) {
+        console.error('Error retrying worksheet:', error);
+        showAlert(`Error: ${error.message}`, 'danger');
+    }
+}
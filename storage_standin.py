@@ -0,0 +1,95 @@
+"""Local stand-in for the Supabase Storage object API, for development and tests.
+
+Run:  python storage_standin.py --port 54321 --root /tmp/storage
+Then: STORAGE_URL=http://127.0.0.1:54321 SUPABASE_SERVICE_KEY=dev ...
+
+Implements object upload (POST/PUT /storage/v1/object/<bucket>/<path>) and
+public download (GET /storage/v1/object/public/<bucket>/<path>). Latency and
+a failure rate can be injected to exercise retries and the upload spool.
+"""
+import os
+import time
+import random
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import unquote, urlparse
+
+UPLOAD_PREFIX = "/storage/v1/object/"
+PUBLIC_PREFIX = "/storage/v1/object/public/"
+
+
+def make_handler(root, latency=0.0, fail_rate=0.0):
+    class StorageHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def _reply(self, status, body=b"", content_type="application/json"):
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _object_path(self, prefix):
+            relative = unquote(urlparse(self.path).path[len(prefix):])
+            path = os.path.abspath(os.path.join(root, relative))
+            if not path.startswith(os.path.abspath(root) + os.sep):
+                return None
+            return path
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", 0))
+            data = self.rfile.read(length)
+            if latency:
+                time.sleep(latency)
+            if not self.headers.get("Authorization"):
+                return self._reply(401, b'{"error": "missing authorization"}')
+            if random.random() < fail_rate:
+                return self._reply(503, b'{"error": "injected failure"}')
+            path = self._object_path(UPLOAD_PREFIX)
+            if path is None:
+                return self._reply(400, b'{"error": "bad path"}')
+            if os.path.exists(path) and self.headers.get("x-upsert") != "true":
+                return self._reply(409, b'{"error": "exists"}')
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "wb") as f:
+                f.write(data)
+            self._reply(200, b'{"Key": "ok"}')
+
+        do_PUT = do_POST
+
+        def do_GET(self):
+            if not self.path.startswith(PUBLIC_PREFIX):
+                return self._reply(404, b'{"error": "not found"}')
+            path = self._object_path(PUBLIC_PREFIX)
+            if path is None or not os.path.isfile(path):
+                return self._reply(404, b'{"error": "not found"}')
+            with open(path, "rb") as f:
+                self._reply(200, f.read(), "application/octet-stream")
+
+    return StorageHandler
+
+
+def serve(root, host="127.0.0.1", port=54321, latency=0.0, fail_rate=0.0, background=False):
+    """Start the stand-in server; with background=True returns the running server."""
+    os.makedirs(root, exist_ok=True)
+    server = ThreadingHTTPServer((host, port), make_handler(root, latency, fail_rate))
+    if background:
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+    print(f"Stand-in storage serving {root} on http://{host}:{server.server_port}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--root", default="/tmp/storage-standin")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=54321)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added per upload")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="fraction of uploads answered with 503")
+    args = parser.parse_args()
+    serve(args.root, args.host, args.port, args.latency, args.fail_rate)
@@ -1,10 +1,13 @@
 import os
-from supabase import create_client, Client
+from clients import supabase_client
 
 SUPABASE_URL = os.environ.get("SUPABASE_URL")
 SUPABASE_SERVICE_KEY = os.environ.get("SUPABASE_SERVICE_KEY")
 
-if not SUPABASE_URL or not SUPABASE_SERVICE_KEY:
-    raise RuntimeError("SUPABASE_URL and SUPABASE_SERVICE_KEY must be set")
 
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_SERVICE_KEY)
+def __getattr__(name):
+    # `from supabase_client import supabase` creates the shared client on
+    # first use instead of at import
+    if name == "supabase":
+        return supabase_client()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
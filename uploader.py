@@ -0,0 +1,236 @@
+import os
+import json
+import time
+import uuid
+import random
+import logging
+import mimetypes
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from metrics import STAGE_SECONDS, ERRORS_TOTAL
+
+SUPABASE_URL = os.environ.get("SUPABASE_URL")
+SUPABASE_SERVICE_KEY = os.environ.get("SUPABASE_SERVICE_KEY")
+# Point uploads at a different Supabase-compatible storage API, e.g. the
+# local stand-in in storage_standin.py
+STORAGE_URL = (os.environ.get("STORAGE_URL") or SUPABASE_URL or "").rstrip("/")
+STORAGE_BUCKET = os.environ.get("STORAGE_BUCKET", "worksheets")
+
+UPLOAD_CONCURRENCY = int(os.environ.get("UPLOAD_CONCURRENCY", "8"))
+UPLOAD_RETRIES = int(os.environ.get("UPLOAD_RETRIES", "3"))
+UPLOAD_BACKOFF = float(os.environ.get("UPLOAD_BACKOFF", "0.5"))
+UPLOAD_TIMEOUT = (5, 120)  # connect, read
+# Uploads that still fail after retries are recorded here and retried later;
+# kept out of worksheets/, which is served over HTTP
+UPLOAD_SPOOL_DIR = os.environ.get("UPLOAD_SPOOL_DIR", "var/upload_spool")
+UPLOAD_SWEEP_INTERVAL = int(os.environ.get("UPLOAD_SWEEP_INTERVAL", "60"))
+# Sweeps a spooled upload is retried in before it is set aside as *.failed
+UPLOAD_SPOOL_MAX_ATTEMPTS = int(os.environ.get("UPLOAD_SPOOL_MAX_ATTEMPTS", "100"))
+
+RETRY_STATUSES = {408, 429, 500, 502, 503, 504}
+
+
+class UploadError(Exception):
+    def __init__(self, status, message):
+        super().__init__(f"HTTP {status}: {message}")
+        self.status = status
+
+
+def _remove(path):
+    # Another process's sweeper may have handled the same record
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def _quarantine(path, reason):
+    """Set a spooled record aside (as *.failed) so it is no longer retried."""
+    logging.error("Giving up on spooled upload %s: %s", path, reason)
+    try:
+        os.replace(path, path[:-len(".json")] + ".failed")
+    except FileNotFoundError:
+        pass
+
+
+class ArtifactUploader:
+    """Uploads job artifacts to Supabase Storage over a pooled HTTP session."""
+
+    def __init__(self, base_url=STORAGE_URL, key=SUPABASE_SERVICE_KEY, bucket=STORAGE_BUCKET,
+                 spool_dir=UPLOAD_SPOOL_DIR):
+        self.base_url = base_url
+        self.key = key
+        self.bucket = bucket
+        self.spool_dir = spool_dir
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=UPLOAD_CONCURRENCY)
+        self._session.mount("https://", adapter)
+        self._session.mount("http://", adapter)
+        self._pool = ThreadPoolExecutor(max_workers=UPLOAD_CONCURRENCY, thread_name_prefix="upload")
+        self._sweeper = None
+        self._sweeper_lock = threading.Lock()
+
+    @property
+    def configured(self):
+        return bool(self.base_url and self.key)
+
+    def public_url(self, remote_path):
+        """Public URL of an object, computed locally (no API round trip)."""
+        return f"{self.base_url}/storage/v1/object/public/{self.bucket}/{quote(remote_path)}"
+
+    def _put(self, local_path, remote_path):
+        content_type = mimetypes.guess_type(local_path)[0] or "application/octet-stream"
+        with STAGE_SECONDS.time("upload"), open(local_path, "rb") as f:
+            # The file object is streamed, not read into memory
+            response = self._session.post(
+                f"{self.base_url}/storage/v1/object/{self.bucket}/{quote(remote_path)}",
+                data=f,
+                headers={
+                    "Authorization": f"Bearer {self.key}",
+                    "apikey": self.key,
+                    "Content-Type": content_type,
+                    "x-upsert": "true",
+                },
+                timeout=UPLOAD_TIMEOUT,
+            )
+        if response.status_code >= 300:
+            raise UploadError(response.status_code, response.text[:200])
+
+    def _put_with_retries(self, local_path, remote_path):
+        for attempt in range(UPLOAD_RETRIES + 1):
+            try:
+                self._put(local_path, remote_path)
+                return self.public_url(remote_path)
+            except (requests.RequestException, UploadError) as e:
+                retryable = not isinstance(e, UploadError) or e.status in RETRY_STATUSES
+                if not retryable or attempt == UPLOAD_RETRIES:
+                    raise
+                delay = UPLOAD_BACKOFF * (2 ** attempt) * (0.5 + random.random())
+                logging.warning("Upload of %s failed (%s), retrying in %.1fs", local_path, e, delay)
+                time.sleep(delay)
+
+    def upload(self, local_path, remote_path, job_id=None, column=None):
+        """Upload a file and return its public URL.
+
+        Without storage configured the local path is returned. If the upload
+        still fails after retries it is spooled for the background sweeper,
+        which later sets worksheets.<column> of job_id to the public URL, and
+        the local path is returned for now.
+        """
+        if not self.configured:
+            return local_path
+        try:
+            return self._put_with_retries(local_path, remote_path)
+        except Exception as e:
+            logging.error("Failed to upload %s to storage: %s", local_path, e)
+            ERRORS_TOTAL.inc("upload")
+            self._spool(local_path, remote_path, job_id, column)
+            return local_path
+
+    def upload_async(self, local_path, remote_path, job_id=None, column=None):
+        """Start an upload on the shared upload pool; returns a Future of the URL."""
+        return self._pool.submit(self.upload, local_path, remote_path, job_id, column)
+
+    def upload_many(self, items):
+        """Upload (local_path, remote_path) pairs concurrently; return URLs in order."""
+        futures = [self.upload_async(local_path, remote_path) for local_path, remote_path in items]
+        return [f.result() for f in futures]
+
+    def _spool(self, local_path, remote_path, job_id, column):
+        try:
+            os.makedirs(self.spool_dir, exist_ok=True)
+            record = {"local_path": local_path, "remote_path": remote_path,
+                      "job_id": job_id, "column": column, "attempts": 0}
+            self._write_record(os.path.join(self.spool_dir, f"{uuid.uuid4().hex}.json"), record)
+        except Exception as e:
+            logging.error("Failed to spool upload of %s: %s", local_path, e)
+            return
+        self.start_sweeper()
+
+    def _write_record(self, path, record):
+        with open(path + ".tmp", "w") as f:
+            json.dump(record, f)
+        os.replace(path + ".tmp", path)
+
+    def start_sweeper(self):
+        """Start the background thread that retries spooled uploads."""
+        if not self.configured:
+            return
+        with self._sweeper_lock:
+            if self._sweeper is None or not self._sweeper.is_alive():
+                self._sweeper = threading.Thread(
+                    target=self._sweep_loop, name="upload-sweeper", daemon=True
+                )
+                self._sweeper.start()
+
+    def _sweep_loop(self):
+        while True:
+            time.sleep(UPLOAD_SWEEP_INTERVAL)
+            try:
+                self.sweep()
+            except Exception as e:
+                logging.error("Upload sweep failed: %s", e)
+
+    def sweep(self):
+        """Retry every spooled upload once; returns the number that succeeded."""
+        if not os.path.isdir(self.spool_dir):
+            return 0
+        done = 0
+        for name in sorted(os.listdir(self.spool_dir)):
+            if not name.endswith(".json"):
+                continue
+            path = os.path.join(self.spool_dir, name)
+            try:
+                with open(path) as f:
+                    record = json.load(f)
+            except OSError:
+                continue
+            except ValueError as e:
+                _quarantine(path, f"unreadable record ({e})")
+                continue
+            if not os.path.exists(record["local_path"]):
+                _remove(path)
+                continue
+            try:
+                url = self._put_with_retries(record["local_path"], record["remote_path"])
+            except FileNotFoundError:
+                _remove(path)  # removed since the check above
+                continue
+            except Exception as e:
+                attempts = record.get("attempts", 0) + 1
+                if isinstance(e, UploadError) and e.status not in RETRY_STATUSES:
+                    _quarantine(path, e)
+                elif attempts >= UPLOAD_SPOOL_MAX_ATTEMPTS:
+                    _quarantine(path, f"still failing after {attempts} sweeps ({e})")
+                else:
+                    logging.warning("Spooled upload of %s still failing: %s", record["local_path"], e)
+                    self._write_record(path, dict(record, attempts=attempts))
+                continue
+            if record.get("job_id") and record.get("column"):
+                self._update_worksheet(record["job_id"], record["column"], url)
+            _remove(path)
+            done += 1
+        if done:
+            logging.info("Uploaded %s spooled artifact(s)", done)
+        return done
+
+    def _update_worksheet(self, job_id, column, url):
+        from sqlalchemy import update
+        from app import app, db
+        from models import Worksheet
+
+        if column not in ("pdf_path", "interactive_path"):
+            return
+        with app.app_context():
+            db.session.execute(
+                update(Worksheet).where(Worksheet.id == job_id).values({column: url})
+            )
+            db.session.commit()
+
+
+uploader = ArtifactUploader()
@@ -0,0 +1,108 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+
+from flask_login import UserMixin
+from metrics import CACHE_TOTAL
+
+# Signed-in users are loaded from the database at most once per
+# USER_CACHE_TTL seconds per process. Changes made through the ORM invalidate
+# the entry of this process at once; other processes see them within the TTL.
+USER_CACHE_TTL = float(os.environ.get("USER_CACHE_TTL", "60"))
+USER_CACHE_SIZE = int(os.environ.get("USER_CACHE_SIZE", "10000"))
+
+
+class CachedUser(UserMixin):
+    """Read-only snapshot of a User row, not bound to any session.
+
+    Shared between requests, so it must not be modified; load the User model
+    for anything that writes.
+    """
+
+    def __init__(self, id, username, email, created_at):
+        self.id = id
+        self.username = username
+        self.email = email
+        self.created_at = created_at
+
+    def __repr__(self):
+        return f"<CachedUser {self.id}>"
+
+
+class UserCache:
+    """In-process LRU of CachedUser by id, with a TTL."""
+
+    def __init__(self, ttl=USER_CACHE_TTL, size=USER_CACHE_SIZE):
+        self.ttl = ttl
+        self.size = size
+        self._entries = OrderedDict()  # user id -> (expires_at, CachedUser)
+        self._lock = threading.Lock()
+        # Bumped by invalidate(); a load that raced with one is not stored
+        self._generation = 0
+
+    def get(self, user_id):
+        """The user with this id, or None if there is none."""
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and entry[0] >= time.monotonic():
+                self._entries.move_to_end(user_id)
+                CACHE_TOTAL.inc("user", "hit")
+                return entry[1]
+            generation = self._generation
+        CACHE_TOTAL.inc("user", "miss")
+        user = self._load(user_id)
+        if user is not None:
+            with self._lock:
+                if generation == self._generation:
+                    self._entries[user_id] = (time.monotonic() + self.ttl, user)
+                    self._entries.move_to_end(user_id)
+                    while len(self._entries) > self.size:
+                        self._entries.popitem(last=False)
+        return user
+
+    def invalidate(self, user_id=None):
+        """Forget one user, or every user if user_id is None."""
+        with self._lock:
+            self._generation += 1
+            if user_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(user_id, None)
+
+    def _load(self, user_id):
+        from app import db
+        from models import User
+
+        row = (
+            db.session.query(User.id, User.username, User.email, User.created_at)
+            .filter(User.id == user_id)
+            .first()
+        )
+        return CachedUser(row.id, row.username, row.email, row.created_at) if row else None
+
+
+user_cache = UserCache()
+
+
+def install_invalidation():
+    """Invalidate users updated or deleted through the ORM, at once and
+    again when the change is committed or rolled back."""
+    from sqlalchemy import event
+    from sqlalchemy.orm import Session, object_session
+    from models import User
+
+    def _changed(mapper, connection, target):
+        session = object_session(target)
+        if session is not None:
+            session.info.setdefault("changed_users", set()).add(target.id)
+        user_cache.invalidate(target.id)
+
+    def _settled(session):
+        for user_id in session.info.pop("changed_users", ()):
+            user_cache.invalidate(user_id)
+
+    event.listen(User, "after_update", _changed)
+    event.listen(User, "after_delete", _changed)
+    event.listen(Session, "after_commit", _settled)
+    event.listen(Session, "after_rollback", _settled)
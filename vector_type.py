@@ -0,0 +1,67 @@
+import os
+import struct
+
+from sqlalchemy.types import TypeDecorator, LargeBinary
+
+# Encoding of newly written embeddings: "float32" (4 bytes per dim, exact for
+# the similarity search) or "int8" (1 byte per dim plus a scale, ~4x smaller
+# with a small loss of precision). Stored values carry their own format, so
+# switching only affects rows written afterwards.
+EMBEDDING_STORAGE = os.environ.get("EMBEDDING_STORAGE", "float32")
+
+# Every value starts with a 4-byte format tag so the payload stays 4-byte
+# aligned and np.frombuffer can view it without copying.
+_FLOAT32 = b"f32\0"
+_INT8 = b"i8\0\0"
+_SCALE = struct.Struct("<f")
+
+
+def pack_vector(vector, storage=EMBEDDING_STORAGE):
+    """Encode a vector as bytes in the given storage format."""
+    import numpy as np
+    v = np.asarray(vector, dtype="<f4")
+    if storage == "int8":
+        peak = float(np.max(np.abs(v))) if v.size else 0.0
+        scale = peak / 127 if peak else 1.0
+        q = np.clip(np.rint(v / scale), -127, 127).astype(np.int8)
+        return _INT8 + _SCALE.pack(scale) + q.tobytes()
+    return _FLOAT32 + v.tobytes()
+
+
+def unpack_vector(data):
+    """Decode bytes written by pack_vector into a float32 array.
+
+    float32 values are a read-only view of the buffer, not a copy.
+    """
+    import numpy as np
+    tag = bytes(data[:4])
+    if tag == _FLOAT32:
+        return np.frombuffer(data, dtype="<f4", offset=4)
+    if tag == _INT8:
+        (scale,) = _SCALE.unpack(bytes(data[4:8]))
+        return np.frombuffer(data, dtype=np.int8, offset=8).astype(np.float32) * np.float32(scale)
+    raise ValueError(f"Unknown packed vector format {tag!r}")
+
+
+class PackedVector(TypeDecorator):
+    """A float vector stored compactly in a bytea column.
+
+    Accepts lists or NumPy arrays and returns NumPy float32 arrays.
+    """
+
+    impl = LargeBinary
+    cache_ok = True
+
+    def __init__(self, storage=None):
+        super().__init__()
+        self.storage = storage
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        return pack_vector(value, self.storage or EMBEDDING_STORAGE)
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        return unpack_vector(value)
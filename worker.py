@@ -1,137 +1,431 @@
-import threading
+import os
+import time
 import logging
+import threading
+import multiprocessing
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import cancellation
+from cancellation import CancellationToken, JobCancelled, CANCEL_POLL_INTERVAL
+from metrics import observe_stage, STAGE_SECONDS, JOBS_TOTAL, SPEC_SOURCE_TOTAL, ERRORS_TOTAL
+from log_config import bind, unbind, log_context, configure as configure_logging
+# worker is first imported by the job queue or a request handler, once app
+# has finished loading, so these don't import circularly
+from app import app, db
+from models import Worksheet
+from llm_client import generate_worksheet_spec, generate_embedding
+from embedding_index import index_worksheet
+from semantic_cache import find_similar_spec
+from spec_cache import spec_cache, SPEC_CACHE_ENABLED
+from progress import progress
+from batches import job_finished
+
+# Image generation fan-out limits: per job, and across all jobs in this process
+IMAGE_CONCURRENCY_PER_JOB = int(os.environ.get("IMAGE_CONCURRENCY_PER_JOB", "4"))
+IMAGE_CONCURRENCY_GLOBAL = int(os.environ.get("IMAGE_CONCURRENCY_GLOBAL", "8"))
+_image_slots = threading.BoundedSemaphore(IMAGE_CONCURRENCY_GLOBAL)
+
+# PDF rendering is CPU-bound ReportLab work, so by default it runs in a small
+# process pool shared by all jobs in this process.
+PDF_RENDER_MODE = os.environ.get("PDF_RENDER_MODE", "process")  # process|thread
+PDF_RENDER_WORKERS = int(os.environ.get("PDF_RENDER_WORKERS", "2"))
+_pdf_pool = None
+_pdf_pool_lock = threading.Lock()
+
+# Store each job's stage timings on its row (worksheets.trace_json)
+JOB_TRACE_ENABLED = os.environ.get("JOB_TRACE_ENABLED", "1") == "1"
+
+class ImageGenerator:
+    """Generates element images concurrently as they are submitted.
+
+    Elements can be submitted while the spec is still streaming in. Each
+    distinct description is fetched once from the shared image store (which
+    only generates images it has never seen), and results() returns
+    {description: image_path} in submission order. A failed image is logged
+    and left out, so one bad description never fails the whole job.
+    """
+
+    def __init__(self, job_id, cancel=None):
+        self.job_id = job_id
+        self.cancel = cancel or CancellationToken(job_id)
+        self._futures = {}
+        self._stored = []
+        self.timings = {}  # description -> seconds until the image was ready
+        self._pool = ThreadPoolExecutor(
+            max_workers=IMAGE_CONCURRENCY_PER_JOB, thread_name_prefix=f"images-{job_id[:8]}"
+        )
+        # Drop images that have not started yet
+        self.cancel.on_cancel(lambda: self._pool.shutdown(wait=False, cancel_futures=True))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        # A cancelled job doesn't wait for image requests already in flight;
+        # they finish in the background and are kept in the image store
+        self._pool.shutdown(wait=not self.cancel.cancelled, cancel_futures=True)
+
+    def submit(self, element):
+        """Start generating the image for an element (ignores non-image elements)."""
+        description = element.get("description", "")
+        if element.get("type") != "image" or not description or description in self._futures:
+            return
+        if self.cancel.cancelled:
+            return
+        # The submission index fixes the file name
+        index = len(self._futures)
+        self._futures[description] = self._pool.submit(self._generate, index, description)
+
+    def seed(self, images_data):
+        """Reuse images recorded in a checkpoint that are still on disk."""
+        from concurrent.futures import Future
+        from image_store import image_store, IMAGE_STORE_DIR
 
-# Supabase client for uploading generated files
-try:
-    from supabase_client import supabase
-except Exception as e:  # Supabase may not be configured in dev
-    supabase = None
-    logging.warning(f"Supabase client not available: {e}")
-
-def upload_to_supabase(local_path: str, remote_path: str) -> str:
-    """Upload a file to Supabase Storage and return the public URL."""
-    if not supabase:
-        return local_path
+        for description, path in images_data.items():
+            if description in self._futures:
+                continue
+            if path.startswith(IMAGE_STORE_DIR):
+                if not image_store.acquire(path):
+                    continue
+                self._stored.append(path)
+            elif not os.path.exists(path):
+                continue
+            future = Future()
+            future.set_result(path)
+            self._futures[description] = future
+
+    def _generate(self, index, description):
+        with log_context(job_id=self.job_id):
+            return self._generate_image(index, description)
+
+    def _generate_image(self, index, description):
+        from image_client import generate_line_art_image, placeholder_image, save_image, LINE_ART_PROMPT
+        from image_store import image_store
+
+        def generate():
+            while not _image_slots.acquire(timeout=CANCEL_POLL_INTERVAL):
+                self.cancel.check()
+            try:
+                self.cancel.check()
+                logging.info("Generating image %d: %s", index + 1, description, extra={"sample": "image_generate"})
+                with STAGE_SECONDS.time("image"):
+                    return generate_line_art_image(description, fallback=False)
+            finally:
+                _image_slots.release()
+
+        started = time.perf_counter()
+        try:
+            while True:
+                self.cancel.check()
+                try:
+                    image_path = image_store.get_or_generate(description, LINE_ART_PROMPT, generate)
+                    break
+                except JobCancelled:
+                    if self.cancel.cancelled:
+                        raise
+                    # Another job generating this image was cancelled; take
+                    # over (the failed call left no reference to release)
+            self._stored.append(image_path)
+        except JobCancelled:
+            raise
+        except Exception as e:
+            # Failures are not stored; this job gets a placeholder of its own
+            logging.error("Failed to generate image, using placeholder: %s", e)
+            ERRORS_TOTAL.inc("image")
+            image_path = save_image(placeholder_image(), f"worksheets/{self.job_id}/image_{index}.png")
+        self.timings[description] = round(time.perf_counter() - started, 3)
+        logging.info("Image ready: %s", image_path, extra={"sample": "image_ready"})
+        return image_path
+
+    def release(self):
+        """Unpin the stored images this job used."""
+        from image_store import image_store
+
+        for path in self._stored:
+            image_store.release(path)
+        self._stored = []
+
+    def results(self):
+        """Wait for every submitted image and return {description: image_path}."""
+        images_data = {}
+        for description, future in self._futures.items():
+            try:
+                images_data[description] = self.cancel.wait_for(future)
+            except JobCancelled:
+                raise
+            except Exception as e:
+                logging.error("Failed to generate image: %s", e)
+                # Continue without this image
+        return images_data
+
+@contextmanager
+def timed(timings, stage):
+    """Record the wall time of a pipeline stage in seconds, in timings and in
+    the stage latency histogram."""
+    start = time.perf_counter()
     try:
-        with open(local_path, "rb") as f:
-            supabase.storage.from_("worksheets").upload(remote_path, f, upsert=True)
-        public_url = supabase.storage.from_("worksheets").get_public_url(remote_path)
-        return public_url
-    except Exception as e:
-        logging.error(f"Failed to upload {local_path} to Supabase: {e}")
-        return local_path
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        timings[stage] = round(elapsed, 3)
+        observe_stage(stage, elapsed)
+
+def _get_pdf_pool():
+    """Return the shared PDF render pool, creating it on first use."""
+    global _pdf_pool
+    with _pdf_pool_lock:
+        if _pdf_pool is None:
+            # Worker processes of a process-mode job queue render in threads
+            if PDF_RENDER_MODE == "process" and multiprocessing.parent_process() is None:
+                _pdf_pool = ProcessPoolExecutor(
+                    max_workers=PDF_RENDER_WORKERS, initializer=configure_logging, initargs=(True,)
+                )
+            else:
+                _pdf_pool = ThreadPoolExecutor(
+                    max_workers=PDF_RENDER_WORKERS, thread_name_prefix="pdf-render"
+                )
+        return _pdf_pool
+
+def render_and_upload(spec, job_id, images_data, timings, cancel=None):
+    """Render the PDF and interactive HTML concurrently and upload each as soon
+    as it is ready. Returns (pdf_url, html_url)."""
+    from layout import layout_spec
+    from pdf_generator import create_pdf_from_spec
+    from interactive_generator import generate_interactive_html
+    from artifacts import finalize_artifact, versioned_path
+    from uploader import uploader
+    from image_store import image_store, IMAGE_STORE_DIR
+
+    cancel = cancel or CancellationToken(job_id)
+
+    # One layout drives both renderers
+    with timed(timings, "layout"):
+        layout = layout_spec(spec, images_data)
+
+    def render_pdf():
+        with timed(timings, "pdf_render"):
+            return cancel.wait_for(_get_pdf_pool().submit(
+                create_pdf_from_spec, spec, job_id, images_data, layout
+            ))
+
+    def render_html():
+        with timed(timings, "html_render"):
+            return generate_interactive_html(spec, job_id, images_data, layout)
+
+    def upload(render_future, remote_path, stage, column):
+        local_path = cancel.wait_for(render_future)
+        with log_context(job_id=job_id):
+            digest = finalize_artifact(local_path)
+            cancel.check()
+            with timed(timings, stage):
+                url = uploader.upload(local_path, remote_path, job_id=job_id, column=column)
+            if url == local_path:
+                # Served by the app; a content-versioned URL can be cached forever
+                url = versioned_path(local_path, digest)
+            logging.debug("Artifact %s uploaded to %s", local_path, url)
+        return url
+
+    # Images are already final, so their uploads start right away. Stored
+    # images are shared between jobs and uploaded once under images/.
+    image_uploads = []
+    for path in images_data.values():
+        if path.startswith(IMAGE_STORE_DIR):
+            if image_store.needs_upload(path):
+                image_uploads.append(uploader.upload_async(path, f"images/{os.path.basename(path)}"))
+        else:
+            image_uploads.append(uploader.upload_async(path, f"{job_id}/{os.path.basename(path)}"))
+
+    # pdf render -> pdf upload, html render -> html upload; the two chains overlap
+    pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix=f"render-{job_id[:8]}")
+    try:
+        pdf_future = pool.submit(render_pdf)
+        html_future = pool.submit(render_html)
+        pdf_url_future = pool.submit(
+            upload, pdf_future, f"{job_id}/worksheet.pdf", "pdf_upload", "pdf_path"
+        )
+        html_url_future = pool.submit(
+            upload, html_future, f"{job_id}/interactive.html", "html_upload", "interactive_path"
+        )
+        urls = cancel.wait_for(pdf_url_future), cancel.wait_for(html_url_future)
+    finally:
+        # Once cancelled, don't wait for renders that are already running
+        pool.shutdown(wait=not cancel.cancelled, cancel_futures=True)
+    with timed(timings, "image_uploads"):
+        for future in image_uploads:
+            cancel.wait_for(future)
+    return urls
 
 def start_generation_job(job_id):
-    """Start background thread for worksheet generation."""
-    logging.info(f"Starting generation thread for job {job_id}")
-    thread = threading.Thread(target=run_generation_job, args=(job_id,))
-    thread.daemon = True
-    thread.start()
-    logging.info(f"Thread started for job {job_id}")
-
-def run_generation_job(job_id):
-    """Background job to generate worksheet."""
-    import os
-    import sys
-    
-    # Add current directory to path to ensure imports work
-    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
-    
+    """Wake the worker pool to pick up a newly enqueued (pending) job."""
+    from job_queue import job_queue
+    job_queue.notify()
+    logging.debug("Job %s enqueued", job_id)
+
+def run_generation_job(job_id, queue_wait=None):
+    """Background job to generate worksheet.
+
+    queue_wait is how long the job was pending, for its trace.
+    """
+    # Registered before the row is read, so a cancel from now on is seen
+    cancel = cancellation.register(job_id)
+    images = ImageGenerator(job_id, cancel)
+    batch_id = None
+    job_started = time.perf_counter()
+    log_token = bind(job_id=job_id)
     try:
-        logging.info(f"Worker thread executing for job {job_id}")
-        
-        # Import everything inside the function to avoid circular imports
-        from app import app, db
-        from models import Worksheet  
-        from llm_client import generate_worksheet_spec
-        from image_client import generate_line_art_image, save_image
-        from pdf_generator import create_pdf_from_spec
-        from interactive_generator import generate_interactive_html
+        logging.info("Job started")
         
         with app.app_context():
-            logging.info(f"App context created for job {job_id}")
-            
-            # Update status to in_progress
+            # The job queue has already claimed this job and marked it in_progress
             worksheet = Worksheet.query.get(job_id)
             if not worksheet:
-                logging.error(f"Worksheet {job_id} not found in database")
+                logging.error("Worksheet %s not found in database", job_id)
                 return
+            bind(user_id=worksheet.user_id)
             
-            logging.info(f"Found worksheet {job_id}, updating status to in_progress")
-            worksheet.status = "in_progress"
-            worksheet.progress_step = "Starting generation"
-            worksheet.progress_percent = 5
-            db.session.commit()
+            progress.start(worksheet)
+            batch_id = worksheet.batch_id
             
-            # Check for cancellation
+            # Cancelled between being claimed and starting
             if worksheet.status == "cancelled":
-                logging.info(f"Job {job_id} was cancelled")
-                return
-            
-            # Generate worksheet specification
-            logging.info(f"Step 1/4: Generating worksheet specification for {job_id}")
-            worksheet.progress_step = "Generating content with AI"
-            worksheet.progress_percent = 20
-            db.session.commit()
+                cancel.cancel()
+            cancel.check()
             
-            spec = generate_worksheet_spec(worksheet.prompt_json)
-            logging.info(f"Generated worksheet spec with {len(spec.get('elements', []))} elements")
+            # Stage outputs of an earlier attempt; completed stages are skipped
+            checkpoint = dict(worksheet.checkpoint_json or {})
             
-            worksheet.progress_percent = 40
-            db.session.commit()
+            def save_checkpoint(**outputs):
+                checkpoint.update(outputs)
+                worksheet.checkpoint_json = dict(checkpoint)
+                db.session.commit()
             
-            # Generate images if needed
-            logging.info(f"Step 2/4: Processing images for {job_id}")
-            images_data = {}
-            if worksheet.prompt_json.get("imagesAllowed", False):
-                image_elements = [e for e in spec.get("elements", []) if e.get("type") == "image"]
-                logging.info(f"Found {len(image_elements)} images to generate")
-                for i, element in enumerate(image_elements):
-                    description = element.get("description", "")
-                    if description:
-                        try:
-                            logging.info(f"Generating image {i+1}/{len(image_elements)}: {description}")
-                            image_data = generate_line_art_image(description)
-                            image_path = f"worksheets/{job_id}/image_{len(images_data)}.png"
-                            save_image(image_data, image_path)
-                            images_data[description] = image_path
-                            logging.info(f"Successfully generated image: {image_path}")
-                        except Exception as e:
-                            logging.error(f"Failed to generate image: {e}")
-                            # Continue without this image
-            else:
-                logging.info("Images disabled, skipping image generation")
+            # Generate worksheet specification
+            logging.info("Step 1/3: Generating worksheet specification")
+            progress.update(job_id, progress_step="Generating content with AI", progress_percent=20)
             
-            # Generate PDF
-            logging.info(f"Step 3/4: Generating PDF for {job_id}")
-            pdf_path = create_pdf_from_spec(spec, job_id, images_data)
-            logging.info(f"PDF generated: {pdf_path}")
-            pdf_url = upload_to_supabase(pdf_path, f"{job_id}/worksheet.pdf")
-            logging.info(f"PDF uploaded to: {pdf_url}")
+            timings = {}
+            # The topic embedding is computed here rather than in the request
+            # handler; it only feeds the semantic cache, so failure is not fatal
+            if worksheet.embedding is None:
+                try:
+                    with timed(timings, "embedding"):
+                        worksheet.embedding = generate_embedding(worksheet.prompt_json["topic"])
+                    db.session.commit()
+                    index_worksheet(job_id, worksheet.embedding)
+                except Exception as e:
+                    logging.error("Failed to generate embedding: %s", e)
+                    ERRORS_TOTAL.inc("embedding")
+            cancel.check()
+
+            images_allowed = worksheet.prompt_json.get("imagesAllowed", False)
+            with images:
+                streamed = []
+                spec_started = time.perf_counter()
+                
+                def on_element(element):
+                    """Start work on each element as soon as the LLM has produced it."""
+                    cancel.check()
+                    streamed.append(element)
+                    if len(streamed) == 1:
+                        elapsed = time.perf_counter() - spec_started
+                        timings["spec_first_element"] = round(elapsed, 3)
+                        observe_stage("spec_first_element", elapsed)
+                    if images_allowed:
+                        images.submit(element)
+                    progress.update(job_id, progress_step=f"Generated {len(streamed)} elements")
+                
+                with timed(timings, "spec"):
+                    spec, spec_source = worksheet.spec_json, "checkpoint"
+                    if spec is not None:
+                        logging.info("Resuming with the checkpointed spec")
+                    elif SPEC_CACHE_ENABLED:
+                        spec, spec_source = spec_cache.get(worksheet.prompt_json), "spec_cache"
+                    if spec is None:
+                        cached = find_similar_spec(worksheet.prompt_json, worksheet.embedding, exclude_id=job_id)
+                        if cached:
+                            spec, spec_source = cached[1], "semantic_cache"
+                        else:
+                            spec, spec_source = generate_worksheet_spec(
+                                worksheet.prompt_json, on_element=on_element, cancel=cancel
+                            ), "llm"
+                        if SPEC_CACHE_ENABLED:
+                            spec_cache.put(worksheet.prompt_json, spec)
+                SPEC_SOURCE_TOTAL.inc(spec_source)
+                cancel.check()
+                if worksheet.spec_json is None:
+                    worksheet.spec_json = spec
+                    db.session.commit()
+                logging.info("Worksheet spec from %s has %d elements", spec_source, len(spec.get("elements", [])))
+                
+                progress.update(job_id, progress_percent=40)
+                
+                # Images of streamed elements are already underway; this picks up
+                # the rest (e.g. when the spec came from a cache)
+                logging.info("Step 2/3: Processing images")
+                images_data = {}
+                if images_allowed:
+                    images.seed(checkpoint.get("images", {}))
+                    for element in spec.get("elements", []):
+                        images.submit(element)
+                    with timed(timings, "images"):
+                        images_data = images.results()
+                    if images_data != checkpoint.get("images"):
+                        save_checkpoint(images=images_data)
+                else:
+                    logging.info("Images disabled, skipping image generation")
             
-            # Generate interactive HTML
-            logging.info(f"Step 4/4: Generating interactive HTML for {job_id}")
-            html_path = generate_interactive_html(spec, job_id, images_data)
-            logging.info(f"Interactive HTML generated: {html_path}")
-            html_url = upload_to_supabase(html_path, f"{job_id}/interactive.html")
-            logging.info(f"HTML uploaded to: {html_url}")
+            cancel.check()
+            # Render PDF and interactive HTML in parallel, uploading each when ready
+            logging.info("Step 3/3: Rendering PDF and interactive HTML")
+            progress.update(job_id, progress_step="Building PDF and interactive worksheet", progress_percent=70)
+            artifacts = checkpoint.get("artifacts")
+            if not artifacts:
+                with timed(timings, "render_and_upload"):
+                    pdf_url, html_url = render_and_upload(spec, job_id, images_data, timings, cancel)
+                artifacts = {"pdf_path": pdf_url, "interactive_path": html_url}
+            pdf_url, html_url = artifacts["pdf_path"], artifacts["interactive_path"]
+            if JOB_TRACE_ENABLED:
+                worksheet.trace_json = {
+                    "queue_wait": None if queue_wait is None else round(queue_wait, 3),
+                    "total": round(time.perf_counter() - job_started, 3),
+                    "spec_source": spec_source,
+                    "stages": timings,
+                    "images": images.timings,
+                }
+            save_checkpoint(artifacts=artifacts)
             
-            # Update worksheet record
-            worksheet.status = "done"
-            worksheet.pdf_path = pdf_url
-            worksheet.interactive_path = html_url
-            db.session.commit()
+            cancel.check()
+            # Status goes through the progress reporter so the two writers
+            # never race
+            progress.update(job_id, status="done", pdf_path=pdf_url, interactive_path=html_url)
+            JOBS_TOTAL.inc("done")
             
-            logging.info(f"Successfully completed worksheet generation for {job_id}")
+            logging.info("Worksheet generation completed", extra={"timings": timings})
             
+    except JobCancelled:
+        logging.info("Job was cancelled, stopping")
+        JOBS_TOTAL.inc("cancelled")
+        try:
+            # The row is already cancelled; this updates in-memory state only
+            progress.update(job_id, status="cancelled", progress_step=cancellation.CANCELLED_STEP)
+        except Exception as e:
+            logging.error("Failed to record cancellation: %s", e)
     except Exception as e:
-        logging.error(f"Error generating worksheet {job_id}: {e}")
+        logging.error("Error generating worksheet: %s", e)
+        JOBS_TOTAL.inc("error")
+        ERRORS_TOTAL.inc("job")
         try:
-            with db.app.app_context():
-                worksheet = Worksheet.query.get(job_id)
-                if worksheet:
-                    worksheet.status = "error"
-                    worksheet.error_message = str(e)
-                    db.session.commit()
+            progress.update(job_id, status="error", error_message=str(e))
         except Exception as db_error:
-            logging.error(f"Failed to update error status: {db_error}")
+            logging.error("Failed to update error status: %s", db_error)
+    finally:
+        images.release()
+        cancellation.unregister(cancel)
+        progress.finish(job_id)
+        try:
+            cancellation.mark_stopped(job_id)
+        except Exception as e:
+            logging.error("Failed to mark job as stopped: %s", e)
+        if batch_id:
+            job_finished(batch_id)
+        unbind(log_token)